@@ -7,17 +7,34 @@ import sys
 import traceback
 import time
 import logging
+import signal
+import random
+import json
+import threading
+import struct
+import zlib
+import heapq
+import hashlib
+import multiprocessing
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from collections import OrderedDict
+from itertools import islice
+from contextlib import contextmanager
 from logging.handlers import TimedRotatingFileHandler
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin, quote
 from datetime import datetime, timezone, timedelta
 
 # Telegram 库
-from telethon import TelegramClient
+from telethon import TelegramClient, utils
 from telethon.sessions import StringSession
-from telethon.tl.types import MessageEntityTextUrl
+from telethon.tl.types import MessageEntityTextUrl, InputPeerChannel
 from telethon.tl.functions.messages import ImportChatInviteRequest
 from telethon.tl.functions.channels import JoinChannelRequest
-from telethon.errors import ChannelPrivateError
+from telethon.errors import ChannelPrivateError, ChannelInvalidError, FloodWaitError
 
 # 导入配置管理器
 import config_manager
@@ -30,6 +47,9 @@ API_HASH = ''
 STRING_SESSION = ''
 ALIST_URL = ''
 ALIST_KEY = ''
+PUSH_MODE = 'single'
+PUSH_BATCH_SIZE = 100
+IMPORT_URL = ''
 ENABLE_189 = True
 ENABLE_UC = False
 ENABLE_123 = False
@@ -39,10 +59,21 @@ SAVE_PATH = '/app/data'
 LOOP_SWITCH = 2
 MONITOR_INTERVAL_HOURS = 3
 MAX_CONCURRENT_REQUESTS = 10
+CHANNEL_CONCURRENCY = 3
 MONITOR_LIMIT = 3000
 MONITOR_DAYS = 365
 SMART_STOP_COUNT = 50
 DB_RETENTION_DAYS = 30
+SCAN_MODE = 'incremental'
+SCAN_CHUNK_SIZE = 100
+PRIORITY_SEARCH_MODE = 'channel'
+TG_RATE_LIMIT = 5
+ENTITY_CACHE_TTL_HOURS = 24
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_DRAIN_SECONDS = 120
+ARCHIVE_MESSAGES = False
+EXTRACT_WORKERS = 0
+EXTRACT_CACHE_SIZE = 4096
 CHANNEL_URLS = []
 EXCLUDE_KEYWORDS = []
 API_CONFIGS = []
@@ -66,9 +97,14 @@ def load_global_config():
     STRING_SESSION = CONFIG['TELEGRAM'].get('STRING_SESSION', '')
 
     # --- 2. Alist-TVBox 接口配置 ---
-    global ALIST_URL, ALIST_KEY
+    global ALIST_URL, ALIST_KEY, PUSH_MODE, PUSH_BATCH_SIZE, IMPORT_URL
     ALIST_URL = CONFIG['ALIST'].get('URL', '')
     ALIST_KEY = CONFIG['ALIST'].get('KEY', '')
+    # single = 每个分享单独 POST; bulk = 按 PUSH_BATCH_SIZE 条一批调用导入接口，不可用时回退逐条 POST
+    PUSH_MODE = CONFIG['ALIST'].get('PUSH_MODE', 'single')
+    PUSH_BATCH_SIZE = max(1, int(CONFIG['ALIST'].get('PUSH_BATCH_SIZE', 100)))
+    # 批量导入接口地址，留空时使用 ALIST_URL 同一主机的 /api/import-shares
+    IMPORT_URL = CONFIG['ALIST'].get('IMPORT_URL', '') or (urljoin(ALIST_URL, '/api/import-shares') if ALIST_URL else '')
 
     # --- 3. 云盘抓取开关 ---
     global ENABLE_189, ENABLE_UC, ENABLE_123, ENABLE_115, ENABLE_QUARK
@@ -80,15 +116,37 @@ def load_global_config():
 
 
     # --- 4. 运行环境与扫描配置 ---
-    global SAVE_PATH, LOOP_SWITCH, MONITOR_INTERVAL_HOURS, MAX_CONCURRENT_REQUESTS, MONITOR_LIMIT, MONITOR_DAYS, SMART_STOP_COUNT, DB_RETENTION_DAYS
+    global SAVE_PATH, LOOP_SWITCH, MONITOR_INTERVAL_HOURS, MAX_CONCURRENT_REQUESTS, CHANNEL_CONCURRENCY, MONITOR_LIMIT, MONITOR_DAYS, SMART_STOP_COUNT, DB_RETENTION_DAYS, SCAN_MODE, SCAN_CHUNK_SIZE, PRIORITY_SEARCH_MODE, TG_RATE_LIMIT, ENTITY_CACHE_TTL_HOURS, OUTBOX_MAX_ATTEMPTS, OUTBOX_DRAIN_SECONDS, ARCHIVE_MESSAGES, EXTRACT_WORKERS, EXTRACT_CACHE_SIZE
     SAVE_PATH = CONFIG['MONITORING'].get('SAVE_PATH', '/app/data')
     LOOP_SWITCH = CONFIG['MONITORING'].get('LOOP_SWITCH', 2)
     MONITOR_INTERVAL_HOURS = CONFIG['MONITORING'].get('MONITOR_INTERVAL_HOURS', 3)
     MAX_CONCURRENT_REQUESTS = CONFIG['MONITORING'].get('MAX_CONCURRENT_REQUESTS', 10)
+    # 同时扫描的频道数，1 = 逐个频道顺序扫描 (旧行为)
+    CHANNEL_CONCURRENCY = max(1, int(CONFIG['MONITORING'].get('CHANNEL_CONCURRENCY', 3)))
     MONITOR_LIMIT = CONFIG['MONITORING'].get('MONITOR_LIMIT', 3000)
     MONITOR_DAYS = CONFIG['MONITORING'].get('MONITOR_DAYS', 365)
     SMART_STOP_COUNT = CONFIG['MONITORING'].get('SMART_STOP_COUNT', 50)
     DB_RETENTION_DAYS = CONFIG['MONITORING'].get('DB_RETENTION_DAYS', 30)
+    # incremental = 从上次记录的最高 msg_id 之后拉取; full = 每次从最新消息开始完整回溯 (旧行为)
+    SCAN_MODE = CONFIG['MONITORING'].get('SCAN_MODE', 'incremental')
+    # Phase 1 流式处理时每块的消息数，内存峰值约为 4 块消息，与 MONITOR_LIMIT 无关
+    SCAN_CHUNK_SIZE = max(1, int(CONFIG['MONITORING'].get('SCAN_CHUNK_SIZE', 100)))
+    # 优先关键词搜索方式: channel 逐频道搜索，global 每个关键词只做一次跨会话全局搜索
+    PRIORITY_SEARCH_MODE = CONFIG['MONITORING'].get('PRIORITY_SEARCH_MODE', 'channel')
+    # 所有频道共享的 Telegram 请求速率上限 (次/秒)，遇到 FloodWait 时自动下调
+    TG_RATE_LIMIT = max(0.1, float(CONFIG['MONITORING'].get('TG_RATE_LIMIT', 5)))
+    # 频道解析结果 (peer id + access hash) 的缓存有效期，0 = 不使用缓存
+    ENTITY_CACHE_TTL_HOURS = max(0.0, float(CONFIG['MONITORING'].get('ENTITY_CACHE_TTL_HOURS', 24)))
+    # 推送失败进入 outbox 后的最大重试次数，超过后标记为 failed
+    OUTBOX_MAX_ATTEMPTS = max(1, int(CONFIG['MONITORING'].get('OUTBOX_MAX_ATTEMPTS', 10)))
+    # 单次运行 (LOOP_SWITCH=2) 扫描结束后继续等待 outbox 重试的最长秒数，之后到期的记录留给下次运行
+    OUTBOX_DRAIN_SECONDS = max(0, float(CONFIG['MONITORING'].get('OUTBOX_DRAIN_SECONDS', 120)))
+    # Phase 1 拉取到的消息同时写入 SAVE_PATH/archive 下的压缩归档，用于离线重新处理
+    ARCHIVE_MESSAGES = CONFIG['MONITORING'].get('ARCHIVE_MESSAGES', False)
+    # 链接提取与关键词扫描使用的子进程数，0 = 在事件循环线程中执行 (旧行为)
+    EXTRACT_WORKERS = max(0, int(CONFIG['MONITORING'].get('EXTRACT_WORKERS', 0)))
+    # extract_links 结果缓存的条数上限 (按消息内容)，0 = 不缓存
+    EXTRACT_CACHE_SIZE = max(0, int(CONFIG['MONITORING'].get('EXTRACT_CACHE_SIZE', 4096)))
 
     # --- 5. 监控频道列表 ---
     global CHANNEL_URLS
@@ -124,6 +182,10 @@ class Dashboard:
     # 列宽配置: Channel/Project(16) | Progress(13) | Found(13) | Added(13) | Time(13)
     HEADER_FMT = "{:<16} | {:>13} | {:>13} | {:>13} | {:>13}"
     ROW_FMT    = "{:<16} | {:>13} | {:>13} | {:>13} | {:>13}"
+
+    # 并发扫描时，所有进行中的频道共用底部的"实时区域"，完成的频道固定输出在其上方
+    _live_frames = {}
+    _live_height = 0
     
     @staticmethod
     def print_header():
@@ -132,8 +194,7 @@ class Dashboard:
         print("-" * 80)
 
     @staticmethod
-    def print_channel_frame(channel_name, total, current, stats, start_time, is_final=False):
-        """绘制信息"""
+    def _build_lines(channel_name, total, current, stats, start_time):
         # 计算耗时
         duration_str = "-"
         if start_time:
@@ -182,18 +243,47 @@ class Dashboard:
             if sp_found > 0 or sp_added > 0:
                  line_special = Dashboard.ROW_FMT.format("  |_ Priority", "-", str(sp_found), str(sp_added), "-")
                  rule_lines.append(line_special)
+        return rule_lines
 
-        # 打印并处理光标回退
-        print("\r" + "\n".join(rule_lines) + "\033[K", end="")
-        
-        # 回退光标到起始位置
-        if not is_final:
-            for _ in range(len(rule_lines) - 1):
-                 sys.stdout.write("\033[F")
-            sys.stdout.write("\033[F\033[K")
-            sys.stdout.flush()
+    @staticmethod
+    def _clear_live():
+        # 回退光标到实时区域顶部并清屏到末尾
+        if Dashboard._live_height:
+            sys.stdout.write("\033[F" * Dashboard._live_height + "\033[J")
+            Dashboard._live_height = 0
+
+    @staticmethod
+    def _draw_live():
+        height = 0
+        for lines in Dashboard._live_frames.values():
+            for line in lines:
+                sys.stdout.write(line + "\033[K\n")
+            height += len(lines)
+        Dashboard._live_height = height
+        sys.stdout.flush()
+
+    @staticmethod
+    def print_channel_frame(channel_name, total, current, stats, start_time, is_final=False, key=None):
+        """绘制信息。key 标识实时区域中的帧 (频道 id)，显示名相同的频道 (如 +invite 链接) 不会互相覆盖"""
+        rule_lines = Dashboard._build_lines(channel_name, total, current, stats, start_time)
+        key = key or channel_name
+
+        Dashboard._clear_live()
+        if is_final:
+            # 完成的频道移出实时区域，固定输出
+            Dashboard._live_frames.pop(key, None)
+            print("\n".join(rule_lines))
+            print("-" * 80)
         else:
-            print() # 完成时换行
+            Dashboard._live_frames[key] = rule_lines
+        Dashboard._draw_live()
+
+    @staticmethod
+    def print_message(text):
+        """在实时区域上方输出一行普通信息，避免被刷新覆盖"""
+        Dashboard._clear_live()
+        print(text)
+        Dashboard._draw_live()
 
 # ==============================================================================
 # ====== 💻 核心逻辑代码 (Core Logic) ===========================================
@@ -201,27 +291,103 @@ class Dashboard:
 
 RE_ACCESS_CODE = re.compile(r'(?:密码|提取码|验证码|访问码|分享密码|密钥|pwd|password|share_pwd|pass_code|#)[=:：\s]*([a-zA-Z0-9]{4,6})(?![a-zA-Z0-9])', re.IGNORECASE)
 RE_URL_PARAM_CODE = re.compile(r'[?&](?:pwd|password|access_code|code|sharepwd)=([a-zA-Z0-9]{4,6})', re.IGNORECASE)
-RE_TIANYI = re.compile(r'(?:https?://)?cloud\.189\.cn/t/([a-zA-Z0-9]{12})\b', re.IGNORECASE)
-RE_UC = re.compile(r'drive\.uc\.cn/s/([a-zA-Z0-9\-_]+)([^#]*)?(#*/list/share/([^\?\-]+))?', re.IGNORECASE)
-RE_123 = re.compile(r'(?:https?://)?(?:www\.)?(?:123[\d]*|pan\.123)\.com/s/([a-zA-Z0-9\-_]+)', re.IGNORECASE)
-RE_115 = re.compile(r'(?:https?://)?(?:www\.)?(?:115cdn\.com|115\.com)/s/([a-zA-Z0-9]+)', re.IGNORECASE)
-RE_QUARK = re.compile(r'(?:https?://)?pan\.quark\.cn/s/([a-zA-Z0-9]{12})\b', re.IGNORECASE)
+# 支持的网盘: (类型, type_id, 标准链接前缀, 开关名, 正则, 链接头正则)
+# 正则中分享码使用与类型对应的命名分组；链接头正则只在尾部可选内容很长时提供 (UC)，
+# 合并扫描时只匹配链接头，完整匹配在命中后再单独计算
+CLOUD_PROVIDERS = [
+    ('tianyi', 9, "https://cloud.189.cn/t/", 'ENABLE_189',
+     r'(?:https?://)?cloud\.189\.cn/t/(?P<tianyi>[a-zA-Z0-9]{12})\b', None),
+    ('uc', 7, "https://drive.uc.cn/s/", 'ENABLE_UC',
+     r'drive\.uc\.cn/s/(?P<uc>[a-zA-Z0-9\-_]+)(?:[^#]*)?(?:#*/list/share/(?:[^\?\-]+))?',
+     r'drive\.uc\.cn/s/(?P<uc>[a-zA-Z0-9\-_]+)'),
+    ('123', 3, "https://www.123865.com/s/", 'ENABLE_123',
+     r'(?:https?://)?(?:www\.)?(?:123[\d]*|pan\.123)\.com/s/(?P<pan123>[a-zA-Z0-9\-_]+)', None),
+    ('115', 8, "https://115cdn.com/s/", 'ENABLE_115',
+     r'(?:https?://)?(?:www\.)?(?:115cdn\.com|115\.com)/s/(?P<pan115>[a-zA-Z0-9]+)', None),
+    ('quark', 5, "https://pan.quark.cn/s/", 'ENABLE_QUARK',
+     r'(?:https?://)?pan\.quark\.cn/s/(?P<quark>[a-zA-Z0-9]{12})\b', None),
+]
+
+
+
+class ProcessedIdSet:
+    """紧凑的已处理 msg_id 集合: 排序后的 array('q') + 二分查找，每个 id 仅占 8 字节"""
+
+    def __init__(self, ids):
+        self._ids = array('q', ids)
 
+    def __contains__(self, msg_id):
+        i = bisect_left(self._ids, msg_id)
+        return i < len(self._ids) and self._ids[i] == msg_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def nbytes(self):
+        return len(self._ids) * self._ids.itemsize
 
 
 class SQLiteManager:
-    """SQLite 数据库管理器，用于存储已处理的消息和已推送的链接。"""
+    """SQLite 数据库管理器，用于存储已处理的消息和已推送的链接。
+
+    写入采用 write-behind 缓冲: add_link / bulk_add_msgs 先进入内存队列，
+    累计 batch_size 条或距上次提交超过 flush_interval 秒时合并为一个事务提交，
+    close() 时强制提交剩余数据。
+    """
     
-    def __init__(self, db_path):
+    # 存储调优参数: WAL 让读写互不阻塞，synchronous=NORMAL 在 WAL 下每次提交不再强制 fsync
+    PRAGMAS = [
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("temp_store", "MEMORY"),
+        ("mmap_size", 256 * 1024 * 1024),
+        ("cache_size", -32000),  # 负数单位为 KiB，约 32MB
+    ]
+
+    # 版本化迁移，按顺序执行，当前版本记录在 PRAGMA user_version 中
+    MIGRATIONS = [
+        "_migrate_v1_add_timestamp",
+        "_migrate_v2_timestamp_index",
+        "_migrate_v3_channel_state",
+        "_migrate_v4_search_state",
+        "_migrate_v5_entity_cache",
+        "_migrate_v6_outbox",
+        "_migrate_v7_rule_state",
+        "_migrate_v8_search_marks",
+        "_migrate_v9_rule_ranges",
+    ]
+
+    def __init__(self, db_path, batch_size=200, flush_interval=5, readonly=False):
         # 使用全局配置 DB_RETENTION_DAYS 和 SAVE_PATH
         if db_path and not os.path.exists(db_path):
             try: os.makedirs(db_path, exist_ok=True)
             except: pass
         self.db_file = os.path.join(db_path, "189api.db") if db_path else "189api.db"
-        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.readonly = readonly
+        if readonly:
+            # 只读连接供 AsyncSQLiteManager 的读线程使用，不做建表和迁移
+            self.conn = sqlite3.connect(f"file:{quote(os.path.abspath(self.db_file))}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
         self.cursor = self.conn.cursor()
-        self._init_db()
-        self._migrate_db() 
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending_links = []
+        self._pending_msgs = []
+        self._pending_state = {}
+        self._pending_search = {}
+        self._last_flush = time.time()
+        self._apply_pragmas()
+        if not readonly:
+            self._init_db()
+            self._migrate_db() 
+
+    def _apply_pragmas(self):
+        for name, value in self.PRAGMAS:
+            if self.readonly and name == "journal_mode": continue
+            try: self.cursor.execute(f"PRAGMA {name}={value}")
+            except Exception as e: print(f"DB Pragma Error ({name}): {e}")
 
     def _init_db(self):
         try:
@@ -236,49 +402,659 @@ class SQLiteManager:
             print(f"DB Error: {e}")
 
     def _migrate_db(self):
+        """按 user_version 依次执行未完成的迁移，旧数据库原地升级。
+        每一步的 DDL 与 user_version 在同一个显式事务中提交，失败时整步回滚"""
+        # sqlite3 的隐式事务不包含 DDL，迁移期间关闭隐式事务，手动 BEGIN/COMMIT
+        isolation_level = self.conn.isolation_level
+        self.conn.isolation_level = None
         try:
-            self.cursor.execute("PRAGMA table_info(processed_msgs)")
-            columns = [info[1] for info in self.cursor.fetchall()]
-            if 'timestamp' not in columns:
-                self.cursor.execute("ALTER TABLE processed_msgs ADD COLUMN timestamp REAL DEFAULT 0")
-                self.conn.commit()
-        except: pass
+            version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+            for target, name in enumerate(self.MIGRATIONS, start=1):
+                if version >= target: continue
+                self.cursor.execute("BEGIN")
+                try:
+                    getattr(self, name)()
+                    self.cursor.execute(f"PRAGMA user_version={target}")
+                    self.cursor.execute("COMMIT")
+                except BaseException:
+                    self.cursor.execute("ROLLBACK")
+                    raise
+                version = target
+        except Exception as e:
+            print(f"DB Migration Error: {e}")
+        finally:
+            self.conn.isolation_level = isolation_level
+
+    def _migrate_v1_add_timestamp(self):
+        self.cursor.execute("PRAGMA table_info(processed_msgs)")
+        columns = [info[1] for info in self.cursor.fetchall()]
+        if 'timestamp' not in columns:
+            self.cursor.execute("ALTER TABLE processed_msgs ADD COLUMN timestamp REAL DEFAULT 0")
+
+    def _migrate_v2_timestamp_index(self):
+        # cleanup_old_records 按 timestamp 删除，避免全表扫描
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_processed_msgs_timestamp ON processed_msgs(timestamp)")
+
+    def _migrate_v3_channel_state(self):
+        # 每个频道的扫描高水位: 已处理的最大 msg_id 及其记录时间
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS channel_state
+                             (channel_id TEXT PRIMARY KEY, last_msg_id INTEGER, checkpoint REAL)''')
+
+    def _migrate_v4_search_state(self):
+        # 优先关键词搜索的高水位: 每个 (频道, 关键词) 已搜索到的最大 msg_id
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS search_state
+                             (channel_id TEXT, keyword TEXT, last_msg_id INTEGER,
+                              PRIMARY KEY (channel_id, keyword))''')
+
+    def _migrate_v5_entity_cache(self):
+        # 频道链接 -> peer id + access hash，进程重启后无需重新解析
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS entity_cache
+                             (url TEXT PRIMARY KEY, peer_id INTEGER, access_hash INTEGER, resolved_at REAL)''')
+
+    def _migrate_v6_outbox(self):
+        # 推送失败的分享: state 为 pending / in_flight / done / failed，按 next_retry 重试
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS outbox
+                             (link TEXT, api_index INTEGER, payload TEXT, channel TEXT, desc TEXT,
+                              state TEXT, attempts INTEGER DEFAULT 0, next_retry REAL, last_error TEXT, updated REAL,
+                              PRIMARY KEY (link, api_index))''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_state_retry ON outbox(state, next_retry)")
+
+    def _migrate_v7_rule_state(self):
+        # 重新分类的进度: 每条规则 (按规则指纹) 在每个频道已处理过的归档 msg_id 区间
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS rule_state
+                             (channel_id TEXT, rule_key TEXT, low_id INTEGER, high_id INTEGER, updated REAL,
+                              PRIMARY KEY (channel_id, rule_key))''')
+
+    def _migrate_v8_search_marks(self):
+        # 全局搜索的日期下界: 每个 (频道, 关键词) 已被完整搜索覆盖到的时间戳
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS search_marks
+                             (channel_id TEXT, keyword TEXT, covered REAL,
+                              PRIMARY KEY (channel_id, keyword))''')
+
+    def _migrate_v9_rule_ranges(self):
+        # 重新分类的进度改为每条规则若干个区间，只包含处理时归档中已有的 id。
+        # rule_state 的单一区间可能跨过当时还没归档的 id，直接丢弃，下次重新分类全部归档 (sent_links 去重)
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS rule_ranges
+                             (channel_id TEXT, rule_key TEXT, low_id INTEGER, high_id INTEGER,
+                              PRIMARY KEY (channel_id, rule_key, low_id))''')
+        self.cursor.execute("DROP TABLE IF EXISTS rule_state")
 
     def cleanup_old_records(self, days=DB_RETENTION_DAYS): # 使用全局配置 DB_RETENTION_DAYS
         try:
             cutoff = time.time() - (days * 86400)
             self.cursor.execute("DELETE FROM processed_msgs WHERE timestamp > 0 AND timestamp < ?", (cutoff,))
+            self.cursor.execute("DELETE FROM outbox WHERE state IN ('done', 'failed') AND updated < ?", (cutoff,))
             self.conn.commit()
         except: pass
 
     def close(self):
-        if self.conn: self.conn.close()
+        if self.conn:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    def flush(self):
+        """将缓冲区中的 sent_links / processed_msgs 写入合并为一个事务提交。
+        缓冲区已全部提交时返回 True，提交失败 (写入放回缓冲区) 时返回 False"""
+        self._last_flush = time.time()
+        if not (self._pending_links or self._pending_msgs or self._pending_state or self._pending_search): return True
+        if not self.conn: return False
+        links, msgs, states, searches = self._pending_links, self._pending_msgs, self._pending_state, self._pending_search
+        self._pending_links, self._pending_msgs, self._pending_state, self._pending_search = [], [], {}, {}
+        try:
+            with self.conn:
+                if links:
+                    self.cursor.executemany("INSERT OR IGNORE INTO sent_links VALUES (?,?)", links)
+                if msgs:
+                    self.cursor.executemany("INSERT OR IGNORE INTO processed_msgs (channel_id, msg_id, api_index, timestamp) VALUES (?,?,?,?)", msgs)
+                if states:
+                    # 高水位只会前进
+                    self.cursor.executemany('''INSERT INTO channel_state (channel_id, last_msg_id, checkpoint) VALUES (?,?,?)
+                                             ON CONFLICT(channel_id) DO UPDATE SET
+                                             last_msg_id=MAX(last_msg_id, excluded.last_msg_id), checkpoint=excluded.checkpoint''',
+                                            [(cid, mid, ts) for cid, (mid, ts) in states.items()])
+                if searches:
+                    self.cursor.executemany('''INSERT INTO search_state (channel_id, keyword, last_msg_id) VALUES (?,?,?)
+                                             ON CONFLICT(channel_id, keyword) DO UPDATE SET
+                                             last_msg_id=MAX(last_msg_id, excluded.last_msg_id)''',
+                                            [(cid, kw, mid) for (cid, kw), mid in searches.items()])
+        except BaseException as e:
+            # 提交失败或被中断 (SIGTERM -> SystemExit) 时事务已回滚，放回队列，下次 flush / close 重试
+            self._pending_links = links + self._pending_links
+            self._pending_msgs = msgs + self._pending_msgs
+            for cid, state in states.items(): self._pending_state.setdefault(cid, state)
+            for key, mid in searches.items(): self._pending_search.setdefault(key, mid)
+            if not isinstance(e, Exception): raise
+            print(f"DB Error: {e}")
+            return False
+        return True
+
+    def _maybe_flush(self):
+        pending = len(self._pending_links) + len(self._pending_msgs)
+        if pending >= self.batch_size or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
 
     def is_msg_processed(self, channel_id, msg_id):
+        if self._pending_msgs: self.flush()
         try:
             self.cursor.execute("SELECT 1 FROM processed_msgs WHERE channel_id=? AND msg_id=? LIMIT 1", (channel_id, msg_id))
             return self.cursor.fetchone() is not None
         except: return False
 
+    def load_processed_ids(self, channel_id, min_id=0):
+        """一次性加载频道 min_id 之后的已处理 msg_id (主键索引保证有序)，扫描时改为内存判断"""
+        if self._pending_msgs: self.flush()
+        try:
+            self.cursor.execute("SELECT DISTINCT msg_id FROM processed_msgs WHERE channel_id=? AND msg_id>? ORDER BY msg_id", (channel_id, min_id))
+            return ProcessedIdSet(row[0] for row in self.cursor)
+        except: return ProcessedIdSet(())
+
+    def get_channel_state(self, channel_id):
+        """返回 (last_msg_id, checkpoint)，没有记录时为 (0, 0)"""
+        if channel_id in self._pending_state: self.flush()
+        try:
+            self.cursor.execute("SELECT last_msg_id, checkpoint FROM channel_state WHERE channel_id=?", (channel_id,))
+            row = self.cursor.fetchone()
+            return (row[0] or 0, row[1] or 0) if row else (0, 0)
+        except: return (0, 0)
+
+    def update_channel_state(self, channel_id, last_msg_id):
+        """记录频道已处理到的最大 msg_id，随下一次 flush 与已处理消息一起提交"""
+        prev = self._pending_state.get(channel_id, (0, 0))[0]
+        self._pending_state[channel_id] = (max(prev, last_msg_id), time.time())
+        self._maybe_flush()
+
+    def get_search_state(self, channel_id):
+        """返回频道各优先关键词已搜索到的最大 msg_id: {keyword: last_msg_id}"""
+        if self._pending_search: self.flush()
+        try:
+            self.cursor.execute("SELECT keyword, last_msg_id FROM search_state WHERE channel_id=?", (channel_id,))
+            return {kw: mid or 0 for kw, mid in self.cursor.fetchall()}
+        except: return {}
+
+    def update_search_state(self, channel_id, keyword, last_msg_id):
+        key = (channel_id, keyword)
+        self._pending_search[key] = max(self._pending_search.get(key, 0), last_msg_id)
+        self._maybe_flush()
+
+    def get_search_marks(self, channel_id):
+        """返回频道各优先关键词的全局搜索日期下界: {keyword: covered}"""
+        try:
+            self.cursor.execute("SELECT keyword, covered FROM search_marks WHERE channel_id=?", (channel_id,))
+            return dict(self.cursor.fetchall())
+        except: return {}
+
+    def update_search_marks(self, channel_ids, keyword, covered):
+        """下界只会前进"""
+        try:
+            with self.conn:
+                self.cursor.executemany('''INSERT INTO search_marks (channel_id, keyword, covered) VALUES (?,?,?)
+                                         ON CONFLICT(channel_id, keyword) DO UPDATE SET covered=MAX(covered, excluded.covered)''',
+                                        [(cid, keyword, covered) for cid in channel_ids])
+        except Exception as e: print(f"DB Error: {e}")
+
+    def get_rule_state(self, channel_id):
+        """返回频道各规则已处理的归档区间: {rule_key: [(low_id, high_id), ...]}，按起点排序"""
+        try:
+            self.cursor.execute("SELECT rule_key, low_id, high_id FROM rule_ranges WHERE channel_id=? ORDER BY low_id", (channel_id,))
+            state = {}
+            for key, low, high in self.cursor.fetchall():
+                state.setdefault(key, []).append((low, high))
+            return state
+        except: return {}
+
+    def update_rule_state(self, channel_id, rule_keys, ranges):
+        """把 ranges 并入各规则已处理的区间，重叠或相邻的区间合并"""
+        try:
+            with self.conn:
+                for key in rule_keys:
+                    self.cursor.execute("SELECT low_id, high_id FROM rule_ranges WHERE channel_id=? AND rule_key=?", (channel_id, key))
+                    merged = []
+                    for low, high in sorted(self.cursor.fetchall() + [tuple(r) for r in ranges]):
+                        if merged and low <= merged[-1][1] + 1: merged[-1][1] = max(merged[-1][1], high)
+                        else: merged.append([low, high])
+                    self.cursor.execute("DELETE FROM rule_ranges WHERE channel_id=? AND rule_key=?", (channel_id, key))
+                    self.cursor.executemany("INSERT INTO rule_ranges (channel_id, rule_key, low_id, high_id) VALUES (?,?,?,?)",
+                                            [(channel_id, key, low, high) for low, high in merged])
+        except Exception as e: print(f"DB Error: {e}")
+
+    def get_cached_entity(self, url, max_age):
+        """返回未过期的 (peer_id, access_hash)，没有或已过期时为 None"""
+        try:
+            self.cursor.execute("SELECT peer_id, access_hash FROM entity_cache WHERE url=? AND resolved_at>=?", (url, time.time() - max_age))
+            return self.cursor.fetchone()
+        except: return None
+
+    def cache_entity(self, url, peer_id, access_hash):
+        try:
+            with self.conn:
+                self.cursor.execute("INSERT OR REPLACE INTO entity_cache VALUES (?,?,?,?)", (url, peer_id, access_hash, time.time()))
+        except Exception as e: print(f"DB Error: {e}")
+
+    def invalidate_entity(self, url):
+        try:
+            with self.conn:
+                self.cursor.execute("DELETE FROM entity_cache WHERE url=?", (url,))
+        except: pass
+
     def is_link_sent(self, link, api_index):
+        if self._pending_links: self.flush()
         try:
             self.cursor.execute("SELECT 1 FROM sent_links WHERE link=? AND api_index=?", (link, api_index))
             return self.cursor.fetchone() is not None
         except: return False
 
-    def add_link(self, link, api_index):
+    def get_sent_links(self, links, chunk_size=500):
+        """批量查询已推送的链接，返回 {(link, api_index)} 集合 (分块 IN 查询，避免超出 SQLite 参数上限)"""
+        if self._pending_links: self.flush()
+        sent = set()
+        links = list(set(links))
         try:
-            self.cursor.execute("INSERT OR IGNORE INTO sent_links VALUES (?,?)", (link, api_index))
-            self.conn.commit()
+            for i in range(0, len(links), chunk_size):
+                chunk = links[i:i + chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                self.cursor.execute(f"SELECT link, api_index FROM sent_links WHERE link IN ({placeholders})", chunk)
+                sent.update(self.cursor.fetchall())
         except: pass
+        return sent
+
+    def add_link(self, link, api_index):
+        self._pending_links.append((link, api_index))
+        self._maybe_flush()
             
     def bulk_add_msgs(self, data_list):
         if not data_list: return
+        self._pending_msgs.extend(data_list)
+        self._maybe_flush()
+
+    def enqueue_outbox(self, link, api_index, payload, channel, desc, error, next_retry):
+        """推送失败的分享写入 outbox (立即提交)；已在队列中的保持原状态"""
         try:
-            self.cursor.executemany("INSERT OR IGNORE INTO processed_msgs (channel_id, msg_id, api_index, timestamp) VALUES (?,?,?,?)", data_list)
-            self.conn.commit()
+            with self.conn:
+                self.cursor.execute('''INSERT INTO outbox (link, api_index, payload, channel, desc, state, attempts, next_retry, last_error, updated)
+                                     VALUES (?,?,?,?,?,'pending',1,?,?,?)
+                                     ON CONFLICT(link, api_index) DO UPDATE SET
+                                     state='pending', attempts=1, next_retry=excluded.next_retry, last_error=excluded.last_error, updated=excluded.updated
+                                     WHERE outbox.state IN ('done', 'failed')''',
+                                    (link, api_index, json.dumps(payload, ensure_ascii=False), channel, desc, next_retry, error, time.time()))
+        except Exception as e: print(f"DB Error: {e}")
+
+    def claim_outbox(self, limit):
+        """取出已到重试时间的 pending 记录并标记为 in_flight"""
+        try:
+            with self.conn:
+                self.cursor.execute("SELECT link, api_index, payload, channel, desc, attempts FROM outbox WHERE state='pending' AND next_retry<=? ORDER BY next_retry LIMIT ?",
+                                    (time.time(), limit))
+                rows = self.cursor.fetchall()
+                self.cursor.executemany("UPDATE outbox SET state='in_flight', updated=? WHERE link=? AND api_index=?",
+                                        [(time.time(), row[0], row[1]) for row in rows])
+            return rows
+        except Exception as e:
+            print(f"DB Error: {e}")
+            return []
+
+    def finish_outbox(self, link, api_index, state, attempts, next_retry=None, error=None):
+        try:
+            with self.conn:
+                self.cursor.execute("UPDATE outbox SET state=?, attempts=?, next_retry=?, last_error=?, updated=? WHERE link=? AND api_index=?",
+                                    (state, attempts, next_retry, error, time.time(), link, api_index))
+        except Exception as e: print(f"DB Error: {e}")
+
+    def reset_outbox_in_flight(self):
+        """上次进程退出时未完成的 in_flight 记录恢复为 pending"""
+        try:
+            with self.conn:
+                self.cursor.execute("UPDATE outbox SET state='pending' WHERE state='in_flight'")
         except: pass
 
+    def outbox_counts(self):
+        try:
+            self.cursor.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state")
+            return dict(self.cursor.fetchall())
+        except: return {}
+
+    def next_outbox_retry(self):
+        try:
+            self.cursor.execute("SELECT MIN(next_retry) FROM outbox WHERE state='pending'")
+            return self.cursor.fetchone()[0]
+        except: return None
+
+
+class AsyncSQLiteManager:
+    """SQLiteManager 的异步门面，事件循环中不再直接访问磁盘。
+
+    所有写入 (及依赖写入顺序的操作) 由一个写线程按提交顺序执行: 纯写入方法提交后立即返回，
+    其余方法返回 awaitable。读取在独立的只读连接上执行 (WAL 下与写线程互不阻塞)，
+    读取前若有未提交的写入，先等待写线程 flush，保证读到之前的写入。
+    """
+
+    # 提交后不等待结果的写入
+    WRITE_METHODS = ("add_link", "bulk_add_msgs", "update_channel_state", "update_search_state",
+                     "cache_entity", "invalidate_entity", "enqueue_outbox", "finish_outbox", "update_rule_state",
+                     "update_search_marks")
+    # 在写线程执行并等待结果
+    WRITER_CALLS = ("flush", "claim_outbox", "reset_outbox_in_flight", "cleanup_old_records")
+    # 在读连接执行，执行前需要先提交缓冲区
+    CONSISTENT_READS = ("load_processed_ids", "get_channel_state", "get_sent_links", "get_search_state", "get_rule_state",
+                        "get_search_marks", "is_msg_processed", "is_link_sent")
+    # 在读连接执行，与缓冲区无关
+    READS = ("get_cached_entity", "outbox_counts", "next_outbox_retry")
+
+    def __init__(self, db_path, readers=2):
+        self.db_path = db_path
+        self.db = SQLiteManager(db_path)
+        self._jobs = queue.Queue()
+        # 写入按提交顺序编号；flush 成功提交后记录它入队时的编号，读取前比较两者判断是否有未提交的写入
+        self._write_seq = 0
+        self._flushed_seq = 0
+        self._closed = False
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+        self._local = threading.local()
+        self._readers = []
+        self._reader_lock = threading.Lock()
+        self._read_pool = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+
+    def _writer_loop(self):
+        while True:
+            job = self._jobs.get()
+            if job is None: break
+            fn, args, future = job
+            try:
+                result = fn(*args)
+            except Exception as e:
+                if future is not None: future.set_exception(e)
+                else: print(f"DB Writer Error: {e}")
+            else:
+                if future is not None: future.set_result(result)
+        self.db.close()
+
+    def _reader(self):
+        reader = getattr(self._local, "db", None)
+        if reader is None:
+            reader = self._local.db = SQLiteManager(self.db_path, readonly=True)
+            with self._reader_lock: self._readers.append(reader)
+        return reader
+
+    def _submit(self, name, *args):
+        self._write_seq += 1
+        self._jobs.put((getattr(self.db, name), args, None))
+
+    async def _call(self, name, *args):
+        # 写线程按队列顺序执行，flush 只保证提交在它之前入队的写入
+        seq = self._write_seq
+        future = Future()
+        self._jobs.put((getattr(self.db, name), args, future))
+        result = await asyncio.wrap_future(future)
+        # flush 失败时写入放回了缓冲区，下次读取前仍需 flush
+        if name == "flush" and result: self._flushed_seq = max(self._flushed_seq, seq)
+        return result
+
+    async def _read(self, name, *args, consistent=False):
+        if consistent and self._flushed_seq < self._write_seq:
+            await self._call("flush")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._read_pool, lambda: getattr(self._reader(), name)(*args))
+
+    def __getattr__(self, name):
+        if name in self.WRITE_METHODS:
+            return lambda *args: self._submit(name, *args)
+        if name in self.WRITER_CALLS:
+            return lambda *args: self._call(name, *args)
+        if name in self.CONSISTENT_READS:
+            return lambda *args: self._read(name, *args, consistent=True)
+        if name in self.READS:
+            return lambda *args: self._read(name, *args)
+        raise AttributeError(name)
+
+    async def get_sent_links(self, links, chunk_size=500):
+        # 生成器需在事件循环线程中展开后再交给读线程
+        return await self._read("get_sent_links", list(links), chunk_size, consistent=True)
+
+    def close(self):
+        """提交剩余写入并关闭所有连接 (阻塞直到写线程结束，可重复调用)"""
+        if self._closed: return
+        self._closed = True
+        self._jobs.put(None)
+        self._writer.join()
+        self._read_pool.shutdown(wait=True)
+        for reader in self._readers: reader.close()
+
+
+class ArchivedMessage:
+    """归档 (及 replay.py 回放语料) 中读出的消息，只包含 CloudMonitor 用到的 Telethon Message 字段"""
+    __slots__ = ('id', 'date', 'message', 'text', 'entities', 'peer_id')
+
+    def __init__(self, msg_id, date, text, entities=None, peer_id=None):
+        self.id = msg_id
+        self.date = date
+        self.message = self.text = text
+        self.entities = entities
+        self.peer_id = peer_id
+
+
+class MessageArchive:
+    """按频道追加写入的压缩消息归档，规则调整后可直接从本地重新处理历史消息。
+
+    每个频道一个 <channel_id>.arc 文件，由若干独立压缩的块顺序组成:
+        头部 (magic, 条数, 最小 msg_id, 最大 msg_id, 数据长度) + zlib 压缩的 JSON 数组
+    每条记录为 [id, 时间戳, 文本, [[offset, length, url], ...]]，只保存文字链接实体。
+    打开时只读取块头建立 msg_id 索引，读取时按 id 范围定位块，不需要解压整个文件。
+    """
+
+    MAGIC = b'ARC1'
+    HEADER = struct.Struct('<4sIqqI')
+
+    def __init__(self, root):
+        self.root = root
+        self._blocks = {}   # channel_id -> [(min_id, max_id, offset, length, count), ...] 按写入顺序
+        self._covered = {}  # channel_id -> 已归档 id 区间 (合并后按起点排序的 [lo, hi])
+        self._ends = {}     # channel_id -> 最后一个完整块的结束位置
+        self._lock = threading.Lock()
+
+    def _path(self, channel_id):
+        return os.path.join(self.root, f"{channel_id}.arc")
+
+    def channels(self):
+        if not os.path.isdir(self.root): return []
+        return sorted(name[:-4] for name in os.listdir(self.root) if name.endswith('.arc'))
+
+    @staticmethod
+    def to_row(msg):
+        entities = [[e.offset, e.length, e.url] for e in (msg.entities or []) if isinstance(e, MessageEntityTextUrl)]
+        return [msg.id, int(msg.date.timestamp()), msg.message or "", entities]
+
+    @staticmethod
+    def _merge(covered, lo, hi):
+        # 插入区间并与相邻区间合并
+        i = bisect_left(covered, [lo, lo])
+        if i > 0 and covered[i - 1][1] >= lo - 1: i -= 1
+        j = i
+        while j < len(covered) and covered[j][0] <= hi + 1:
+            lo, hi = min(lo, covered[j][0]), max(hi, covered[j][1])
+            j += 1
+        covered[i:j] = [[lo, hi]]
+
+    @staticmethod
+    def _is_covered(covered, msg_id):
+        i = bisect_right(covered, [msg_id, float('inf')]) - 1
+        return i >= 0 and covered[i][1] >= msg_id
+
+    def _index(self, channel_id):
+        blocks = self._blocks.get(channel_id)
+        if blocks is not None: return blocks
+        blocks, covered, end = [], [], 0
+        path = self._path(channel_id)
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                while end + self.HEADER.size <= size:
+                    f.seek(end)
+                    magic, count, lo, hi, length = self.HEADER.unpack(f.read(self.HEADER.size))
+                    # 写入中断留下的不完整块丢弃，下次追加时截断
+                    if magic != self.MAGIC or end + self.HEADER.size + length > size: break
+                    blocks.append((lo, hi, end + self.HEADER.size, length, count))
+                    self._merge(covered, lo, hi)
+                    end += self.HEADER.size + length
+        self._blocks[channel_id], self._covered[channel_id], self._ends[channel_id] = blocks, covered, end
+        return blocks
+
+    def append(self, channel_id, rows):
+        """追加一块记录 (to_row 的结果)，已归档区间内的消息跳过。返回实际写入的条数。
+        Phase 1 每次拉取的是连续的一段消息，所以按区间判断是否已归档即可。"""
+        with self._lock:
+            self._index(channel_id)
+            covered = self._covered[channel_id]
+            rows = [r for r in rows if not self._is_covered(covered, r[0])]
+            if not rows: return 0
+            ids = [r[0] for r in rows]
+            lo, hi = min(ids), max(ids)
+            payload = zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6)
+            os.makedirs(self.root, exist_ok=True)
+            end = self._ends[channel_id]
+            with open(self._path(channel_id), 'ab') as f:
+                if f.tell() != end: f.truncate(end)
+                f.write(self.HEADER.pack(self.MAGIC, len(rows), lo, hi, len(payload)) + payload)
+            self._blocks[channel_id].append((lo, hi, end + self.HEADER.size, len(payload), len(rows)))
+            self._merge(covered, lo, hi)
+            self._ends[channel_id] = end + self.HEADER.size + len(payload)
+            return len(rows)
+
+    def count(self, channel_id):
+        with self._lock:
+            return sum(b[4] for b in self._index(channel_id))
+
+    def covered(self, channel_id):
+        """已归档的 id 区间 [(lo, hi), ...]，区间内之后不会再追加消息"""
+        with self._lock:
+            self._index(channel_id)
+            return [tuple(r) for r in self._covered[channel_id]]
+
+    def max_id(self, channel_id):
+        with self._lock:
+            return max((b[1] for b in self._index(channel_id)), default=0)
+
+    def min_id(self, channel_id):
+        with self._lock:
+            return min((b[0] for b in self._index(channel_id)), default=0)
+
+    def iter_messages(self, channel_id, min_id=0, max_id=None):
+        """按 id 从新到旧读取 min_id < id <= max_id 的消息，只解压与范围相交的块"""
+        with self._lock:
+            blocks = [b for b in self._index(channel_id) if b[1] > min_id and (max_id is None or b[0] <= max_id)]
+        if not blocks: return
+        # 块之间的 id 范围可能交叠: 按块的最大 id 从大到小解压，
+        # 堆中 id 大于下一块最大 id 的记录不会再被超过，可以先输出
+        blocks.sort(key=lambda b: b[1], reverse=True)
+        heap = []
+        with open(self._path(channel_id), 'rb') as f:
+            for n, (lo, hi, offset, length, count) in enumerate(blocks):
+                f.seek(offset)
+                for row in json.loads(zlib.decompress(f.read(length))):
+                    if row[0] > min_id and (max_id is None or row[0] <= max_id):
+                        heapq.heappush(heap, (-row[0], row))
+                next_hi = blocks[n + 1][1] if n + 1 < len(blocks) else min_id
+                while heap and -heap[0][0] > next_hi:
+                    yield self._message(heapq.heappop(heap)[1])
+
+    @staticmethod
+    def _message(row):
+        msg_id, ts, text, entities = row
+        entities = [MessageEntityTextUrl(o, l, u) for o, l, u in entities] or None
+        return ArchivedMessage(msg_id, datetime.fromtimestamp(ts, timezone.utc), text, entities)
+
+
+class LoopLagProbe:
+    """事件循环延迟探针: 每 interval 秒唤醒一次，记录实际唤醒时间比预期晚了多少"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    def stats(self):
+        if not self.samples: return {}
+        ordered = sorted(self.samples)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return {'samples': len(ordered), 'avg_ms': round(sum(ordered) / len(ordered) * 1000, 1),
+                'p99_ms': round(p99 * 1000, 1), 'max_ms': round(ordered[-1] * 1000, 1)}
+
+    def summary(self):
+        s = self.stats()
+        return f"avg {s['avg_ms']}ms p99 {s['p99_ms']}ms max {s['max_ms']}ms" if s else ""
+
+
+class Metrics:
+    """单轮扫描的分阶段耗时与各频道吞吐量，run_cycle 结束时追加写入 SAVE_PATH/189api_metrics.jsonl。
+
+    stages: {stage: {count, seconds, max}}，count 为该阶段处理的条目数 (消息/请求)；
+    channels: {channel_id: {fetched, msgs, links, pushes, pushed, seconds}}。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.stages = {}
+        self.channels = {}
+
+    def add_time(self, stage, seconds, count=1):
+        s = self.stages.get(stage)
+        if s is None: s = self.stages[stage] = {'count': 0, 'seconds': 0.0, 'max': 0.0}
+        s['count'] += count
+        s['seconds'] += seconds
+        if seconds > s['max']: s['max'] = seconds
+
+    @contextmanager
+    def timer(self, stage, count=1):
+        start = time.perf_counter()
+        try: yield
+        finally: self.add_time(stage, time.perf_counter() - start, count)
+
+    def channel(self, channel_id):
+        c = self.channels.get(channel_id)
+        if c is None: c = self.channels[channel_id] = {'fetched': 0, 'msgs': 0, 'links': 0, 'pushes': 0, 'pushed': 0, 'seconds': 0.0}
+        return c
+
+    def snapshot(self):
+        channels = {}
+        for cid, c in self.channels.items():
+            secs = c['seconds'] or 1e-9
+            channels[cid] = dict(c, seconds=round(c['seconds'], 3), msgs_per_s=round(c['msgs'] / secs, 1),
+                                 links_per_s=round(c['links'] / secs, 1), pushes_per_s=round(c['pushes'] / secs, 1))
+        stages = {k: {'count': v['count'], 'seconds': round(v['seconds'], 3), 'max': round(v['max'], 3)} for k, v in self.stages.items()}
+        return {'ts': datetime.now().isoformat(timespec='seconds'), 'cycle_seconds': round(time.time() - self.started, 3),
+                'stages': stages, 'channels': channels}
+
+    def summary(self):
+        return ", ".join(f"{k} {v['seconds']:.1f}s" for k, v in sorted(self.stages.items(), key=lambda kv: -kv[1]['seconds']))
+
+    @staticmethod
+    def write(path, record):
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except Exception as e: print(f"Metrics Write Error: {e}")
+
 
 class StringCleaner:
     """字符串清理工具，用于提取标题和过滤垃圾信息。"""
@@ -294,39 +1070,608 @@ class StringCleaner:
         r'[a-zA-Z0-9]+\.(cn|com|net)/\S+'
     ]
 
+    # 预编译的清理流水线，顺序与原逐条 re.sub 完全一致，保证输出不变。
+    # 每个广告正则附带"必要字面量": 文本中不含该字面量时不可能匹配，直接跳过这一遍扫描。
+    _AD_GUARDS = [('天翼云盘',), ('🤖',), ('标签',), ('🏷', '#'), ('网盘',), ('资源编号：',), ('网盘',), ('://',), ('/',)]
+    _AD_STEPS = [(guard, re.compile(p, re.IGNORECASE)) for guard, p in zip(_AD_GUARDS, AD_PATTERNS)]
+    _RE_MENTION = re.compile(r'[@#]\S+')
+    _RE_EMOJI = re.compile(r'[\U00010000-\U0010ffff]')
+    _RE_NOT_WHITELIST = re.compile(r'[^\u4e00-\u9fa5a-zA-Z0-9,，.。!！?？:：《》()（）【】\+\-\s\u3000&/_]')
+    _RE_JUNK = re.compile('|'.join(re.escape(kw) for kw in JUNK_KEYWORDS))
+    _RE_NUMERIC_LINE = re.compile(r'^[\d\s\.\-\*]+$')
+
     @staticmethod
+    @lru_cache(maxsize=4096)
     def clean(text):
+        # 纯函数，按行缓存结果: 同一消息内回溯上下文时会反复清理相同的行
         if not text: return ""
-        for p in StringCleaner.AD_PATTERNS:
-            text = re.sub(p, '', text, flags=re.IGNORECASE)
-        text = re.sub(r'https?://\S+', '', text)
-        text = re.sub(r'[@#]\S+', '', text)
+        for guard, regex in StringCleaner._AD_STEPS:
+            if any(g in text for g in guard):
+                text = regex.sub('', text)
+        # 原流程此处还有一次大小写敏感的 https?:// 替换，它是上面忽略大小写 URL 规则的子集，
+        # 且后续替换只会留下以空白开头的右侧文本，不可能拼出新的 URL，因此省略
+        if '@' in text or '#' in text:
+            text = StringCleaner._RE_MENTION.sub('', text)
         # 移除 Emoji
-        text = re.sub(r'[\U00010000-\U0010ffff]', '', text) 
+        text = StringCleaner._RE_EMOJI.sub('', text)
         # 保留技术符号 (& + / _)
-        text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9,，.。!！?？:：《》()（）【】\+\-\s\u3000&/_]', ' ', text)
+        text = StringCleaner._RE_NOT_WHITELIST.sub(' ', text)
         return text.strip()[:195]
 
     @staticmethod
     def is_junk_line(line):
         line = line.strip()
         if len(line) < 2: return True
-        for kw in StringCleaner.JUNK_KEYWORDS:
-            if kw in line: return True
-        if re.match(r'^[\d\s\.\-\*]+$', line): return True
+        if StringCleaner._RE_JUNK.search(line): return True
+        if StringCleaner._RE_NUMERIC_LINE.match(line): return True
         return False
 
+class KeywordMatcher:
+    """多关键词匹配器: 关键词合并为一个预编译正则，一次扫描即可得到文本中出现的全部关键词，
+    结果与逐个 `kw in text` 完全一致 (区分大小写的子串匹配)。"""
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords))
+        words = [k for k in self.keywords if k]
+        # 空关键词与原逻辑一致，视为永远命中
+        self._always = {''} if '' in self.keywords else set()
+        self._regex = None
+        if words:
+            # 长词优先，保证每个位置匹配到的是最长的关键词
+            self._regex = re.compile('|'.join(re.escape(k) for k in sorted(words, key=len, reverse=True)))
+        # 同一位置只会匹配到最长的关键词，而它的前缀关键词在该位置必然同时出现
+        self._prefixes = {k: [p for p in words if k.startswith(p)] for k in words}
+
+    def search(self, text):
+        """是否命中任意一个关键词"""
+        if self._always: return True
+        return self._regex is not None and self._regex.search(text) is not None
+
+    def hits(self, text):
+        """返回文本中出现的全部关键词集合"""
+        found = set(self._always)
+        if self._regex is None: return found
+        # 每次从上一个命中位置的下一个字符继续搜索，允许关键词之间重叠
+        search = self._regex.search
+        m = search(text)
+        while m:
+            found.update(self._prefixes[m.group()])
+            m = search(text, m.start() + 1)
+        return found
+
+
+class ExcludeMatcher:
+    """规则级排除词匹配器: 纯字母数字的关键词合并为一个忽略大小写的整词匹配正则，
+    其余关键词交给 KeywordMatcher 做子串匹配，规则加载时编译一次。"""
+
+    RE_WORD_KEYWORD = re.compile(r'^[a-zA-Z0-9]+$')
+
+    def __init__(self, keywords):
+        words = [kw for kw in keywords if self.RE_WORD_KEYWORD.match(kw)]
+        others = [kw for kw in keywords if not self.RE_WORD_KEYWORD.match(kw)]
+        self._word_re = None
+        if words:
+            alt = '|'.join(re.escape(kw) for kw in sorted(set(words), key=len, reverse=True))
+            self._word_re = re.compile(rf'\b(?:{alt})\b', re.IGNORECASE)
+        self._substr = KeywordMatcher(others)
+
+    def search(self, text):
+        if self._word_re is not None and self._word_re.search(text): return True
+        return self._substr.search(text)
+
+
+class RuleMatcher:
+    """所有规则的 priority / required / optional 关键词合并到一个 KeywordMatcher，每条消息只扫描一次，
+    各规则的判断退化为集合运算；excluded_keywords 按规则预编译为 ExcludeMatcher。"""
+
+    def __init__(self, api_configs):
+        self.rules = []
+        self.excludes = []
+        keywords = []
+        for cfg in api_configs:
+            self.excludes.append(ExcludeMatcher(cfg.get('excluded_keywords', []) or []))
+            priority = cfg.get('priority_keywords', []) or []
+            req = cfg.get('required_keywords', []) or []
+            opt = cfg.get('optional_keywords', []) or []
+            self.rules.append((set(priority), set(req), set(opt)))
+            keywords.extend(priority); keywords.extend(req); keywords.extend(opt)
+        self.matcher = KeywordMatcher(keywords)
+
+    def hits(self, text):
+        return self.matcher.hits(text)
+
+    def is_excluded(self, text, api_idx):
+        return self.excludes[api_idx].search(text)
+
+    def is_priority_hit(self, hits, api_idx):
+        return not self.rules[api_idx][0].isdisjoint(hits)
+
+    def check(self, hits, api_idx):
+        priority, req, opt = self.rules[api_idx]
+        if not (priority and not priority.isdisjoint(hits)):
+            if req and not req <= hits: return False
+        if opt and opt.isdisjoint(hits): return False
+        return True
+
+
+class LinkScanner:
+    """启用的网盘正则合并为一个带命名分组的交替正则，按开关构建一次，
+    每条文本只扫描一遍即可得到 (网盘, 分享码, 位置, 链接文本)。
+
+    结果与原来逐个网盘 finditer 基本一致: 先按网盘顺序、同一网盘内按位置排列；
+    同一网盘内按完整链接去重叠，不同网盘之间互不吞并 (例如 UC 链接很长的尾部)。
+    唯一的差别: 起点落在另一个网盘链接的域名部分 (分享码之前) 的链接不再产出，
+    例如 www.123456115.com/s/x 只算 123 盘链接，原来还会多出一个 115 链接 115.com/s/x。
+    """
+
+    def __init__(self, providers):
+        # 命名分组 -> (排序序号, 类型, type_id, 链接前缀, 完整匹配正则或 None)
+        self.groups = {}
+        heads = []
+        for rank, (ctype, tid, prefix, _, pattern, head) in enumerate(providers):
+            group = re.search(r'\(\?P<(\w+)>', pattern).group(1)
+            full = re.compile(pattern, re.IGNORECASE) if head else None
+            self.groups[group] = (rank, ctype, tid, prefix, full)
+            heads.append(f'(?:{head or pattern})')
+        self.regex = re.compile('|'.join(heads), re.IGNORECASE) if heads else None
+
+    @classmethod
+    def from_switches(cls):
+        """按当前的云盘抓取开关构建"""
+        return cls([p for p in CLOUD_PROVIDERS if globals()[p[3]]])
+
+    def _iter(self, text):
+        """逐个产出 (排序序号, 位置, (类型, type_id, 前缀, 分享码, 位置, 链接文本))"""
+        if self.regex is None: return
+        next_start = {}
+        search = self.regex.search
+        m = search(text)
+        while m:
+            group = m.lastgroup
+            start = m.start()
+            if start < next_start.get(group, 0):
+                # 与同一网盘的上一个链接重叠，逐字符前进以免漏掉其后紧接的链接
+                m = search(text, start + 1)
+                continue
+            rank, ctype, tid, prefix, full = self.groups[group]
+            url = full.match(text, start).group(0) if full else m.group(0)
+            next_start[group] = start + len(url)
+            yield rank, start, (ctype, tid, prefix, m.group(group), start, url)
+            # 从分享码起点继续搜索: 其它网盘的链接可能紧贴在分享码里 (没有分隔符)，分享码前必有域名，保证前进。
+            # 域名内部不再搜索，嵌在域名里的其它网盘链接 (见类注释) 被跳过
+            m = search(text, m.start(group))
+
+    def scan(self, text):
+        """文本中的全部链接"""
+        found = sorted(self._iter(text), key=lambda f: (f[0], f[1]))
+        return [f[2] for f in found]
+
+    def scan_url(self, url):
+        """实体 URL 中每个网盘只取第一个匹配"""
+        first = {}
+        for rank, _, item in self._iter(url):
+            first.setdefault(rank, item)
+        return [first[rank] for rank in sorted(first)]
+
+
+class LineIndex:
+    """消息文本只切分一次并记录每行偏移，按需计算并缓存每行的清理结果，
+    多链接消息中每个链接按位置直接查到它前面最近的有效描述行 (不再逐个链接切片回溯)。"""
+
+    def __init__(self, text):
+        self.text = text
+        self.starts = [0]
+        pos = text.find('\n')
+        while pos != -1:
+            self.starts.append(pos + 1)
+            pos = text.find('\n', pos + 1)
+        # _nearest[i]: 第 i 行及之前最近一条有效行的清理结果，按需填充
+        self._nearest = [None] * len(self.starts)
+
+    @staticmethod
+    def _meaningful(line):
+        line = line.strip()
+        if not line: return ""
+        cleaned = StringCleaner.clean(line)
+        if not cleaned or StringCleaner.is_junk_line(cleaned): return ""
+        return cleaned
+
+    def _line(self, i):
+        end = self.starts[i + 1] - 1 if i + 1 < len(self.starts) else len(self.text)
+        return self.text[self.starts[i]:end]
+
+    def _nearest_at(self, i):
+        # 向前回溯直到遇到有效行或已缓存的行，回溯过的行一并写入缓存，整体为线性时间
+        walked = []
+        found = ""
+        while i >= 0:
+            if self._nearest[i] is not None:
+                found = self._nearest[i]; break
+            cleaned = self._meaningful(self._line(i))
+            if cleaned:
+                self._nearest[i] = found = cleaned; break
+            walked.append(i)
+            i -= 1
+        for j in walked:
+            self._nearest[j] = found
+        return found
+
+    def context_before(self, pos):
+        """pos 之前最近的有效行: 先看同一行中 pos 之前的部分，再看之前的完整行"""
+        li = bisect_right(self.starts, pos) - 1
+        cleaned = self._meaningful(self.text[self.starts[li]:pos])
+        if cleaned: return cleaned
+        return self._nearest_at(li - 1)
+
+
+class ExtractCache:
+    """extract_links 结果的 LRU 缓存，键为消息文本与文字链接实体的摘要。
+    频道重复转发的帖子、Phase 2 搜索到的 Phase 1 已处理过的消息直接复用解析结果。
+    缓存的结果被多条消息共享，调用方不能修改。"""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(msg):
+        text = (msg.message or "").encode('utf-8', 'surrogatepass')
+        # 文本与 url 都带上长度，含 \0 的文本或 url 不会与另一种 "文本 + 实体" 组合得到相同的输入
+        h = hashlib.blake2b(b"%d\0" % len(text), digest_size=16)
+        h.update(text)
+        for ent in msg.entities or ():
+            if isinstance(ent, MessageEntityTextUrl):
+                # 描述取自实体覆盖的文本，偏移和长度也要计入
+                h.update(f"\0{ent.offset}:{ent.length}:{len(ent.url)}:{ent.url}".encode('utf-8', 'surrogatepass'))
+        return h.digest()
+
+    def get(self, key):
+        result = self._data.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self._data[key] = result
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                'hit_rate': round(self.hits / total, 3) if total else 0.0}
+
+    def summary(self):
+        s = self.stats()
+        return f"{s['hits']} hits / {s['misses']} misses ({s['hit_rate']:.0%}), {s['size']} entries" if s['hits'] + s['misses'] else ""
+
+    def reset_counters(self):
+        self.hits = self.misses = 0
+
+
+class RateLimiter:
+    """Telegram 请求的全局令牌桶，所有频道共享同一预算。
+
+    收到 FloodWait 时全体暂停对应秒数并将速率减半，之后每次成功调用缓慢回升到上限 (AIMD)。
+    counters 按方法记录调用次数、排队等待秒数、FloodWait 次数/秒数和重试次数。
+    """
+
+    def __init__(self, rate, burst=None, max_retries=3, max_wait=600):
+        self.max_rate = self.rate = float(rate)
+        self.min_rate = min(self.max_rate, 0.2)
+        self.burst = burst or max(1, int(self.max_rate * 2))
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.pause_until = 0
+        self.counters = {}
+        self._lock = asyncio.Lock()
+
+    def _counter(self, method):
+        return self.counters.setdefault(method, {'calls': 0, 'waited': 0.0, 'floods': 0, 'flood_wait': 0, 'retries': 0})
+
+    async def acquire(self, method):
+        counter = self._counter(method)
+        counter['calls'] += 1
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.pause_until:
+                    delay = self.pause_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+                counter['waited'] += delay
+                await asyncio.sleep(delay)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.02)
+
+    def on_flood(self, method, seconds):
+        counter = self._counter(method)
+        counter['floods'] += 1
+        counter['flood_wait'] += seconds
+        self.rate = max(self.min_rate, self.rate / 2)
+        # 暂停期间不积累令牌，恢复后按新速率重新开始
+        self.pause_until = max(self.pause_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.pause_until
+
+    def _should_retry(self, method, error, attempt):
+        self.on_flood(method, error.seconds)
+        if attempt >= self.max_retries or error.seconds > self.max_wait: return False
+        self._counter(method)['retries'] += 1
+        return True
+
+    async def call(self, method, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            await self.acquire(method)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                if not self._should_retry(method, e, attempt): raise
+                attempt += 1
+                continue
+            self.on_success()
+            return result
+
+    async def iter_messages(self, method, client, entity, limit=None, **kwargs):
+        """每 100 条 (Telethon 单页大小) 占用一个令牌；FloodWait 后从最后一条已返回的消息处续传"""
+        attempt = 0
+        yielded = 0
+        seen = set()
+        while True:
+            await self.acquire(method)
+            page = 0
+            try:
+                remaining = None if limit is None else limit - yielded
+                async for msg in client.iter_messages(entity, limit=remaining, **kwargs):
+                    if entity is None:
+                        # 全局搜索按时间续传，同一时间戳的消息可能重复返回
+                        key = (getattr(msg, 'chat_id', None), msg.id)
+                        if key in seen: continue
+                        seen.add(key)
+                    yield msg
+                    yielded += 1
+                    if entity is None: kwargs['offset_date'] = msg.date
+                    else: kwargs['offset_id'] = msg.id
+                    page += 1
+                    if page >= 100:
+                        self.on_success()
+                        await self.acquire(method)
+                        page = 0
+                self.on_success()
+                return
+            except FloodWaitError as e:
+                if not self._should_retry(method, e, attempt): raise
+                attempt += 1
+
+    def summary(self):
+        """本轮统计摘要: 当前速率及各方法的调用、等待、FloodWait 情况"""
+        parts = []
+        for method, c in sorted(self.counters.items()):
+            part = f"{method} {c['calls']}"
+            if c['waited'] >= 0.1: part += f" wait {c['waited']:.1f}s"
+            if c['floods']: part += f" flood {c['floods']}x/{c['flood_wait']}s retry {c['retries']}"
+            parts.append(part)
+        return f"rate {self.rate:.2f}/s | " + ", ".join(parts) if parts else ""
+
+    def reset_counters(self):
+        self.counters = {}
+
+
+class RateLimitedClient:
+    """TelegramClient 代理: get_entity / 请求调用 / iter_messages 经过 RateLimiter，其余属性透传"""
+
+    def __init__(self, client, limiter):
+        self._client = client
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    async def get_entity(self, entity):
+        return await self.limiter.call('get_entity', self._client.get_entity, entity)
+
+    async def __call__(self, request, *args, **kwargs):
+        return await self.limiter.call(type(request).__name__, self._client, request, *args, **kwargs)
+
+    def iter_messages(self, entity, limit=None, **kwargs):
+        if entity is None: method = 'search_global'
+        elif kwargs.get('search'): method = 'search'
+        else: method = 'iter_messages'
+        return self.limiter.iter_messages(method, self._client, entity, limit, **kwargs)
+
+
+class PushClient:
+    """Alist-TVBox 分享导入接口客户端。
+
+    create_session() 返回带 keep-alive 连接池和 DNS 缓存的会话，连接数与并发上限一致；
+    5xx / 网络错误按指数退避 + 抖动重试，退避期间释放并发名额，慢请求不阻塞其它推送。
+    每次请求的耗时按状态码记入直方图。
+    """
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+
+    def __init__(self, url, key, concurrency, logger=None, retries=3, base_delay=0.5, max_delay=8, timeout=20, import_url=''):
+        self.url = url
+        self.import_url = import_url
+        self.bulk_available = True
+        self.headers = {"x-api-key": key, "Content-Type": "application/json", "Authorization": key}
+        self.concurrency = concurrency
+        self.sem = asyncio.Semaphore(concurrency)
+        self.logger = logger
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.histograms = {}
+
+    def create_session(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency,
+                                         keepalive_timeout=60, use_dns_cache=True, ttl_dns_cache=300)
+        return aiohttp.ClientSession(connector=connector)
+
+    def _observe(self, status, elapsed):
+        counts = self.histograms.setdefault(status, [0] * (len(self.LATENCY_BUCKETS) + 1))
+        counts[bisect_left(self.LATENCY_BUCKETS, elapsed)] += 1
+
+    def _backoff(self, attempt):
+        # equal jitter: 至少等待一半的退避时间，避免同时失败的请求一起重试
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _send(self, session, url, payload, label=""):
+        """带退避重试的 POST，返回 (status, error, body)；status 为 None 表示网络错误"""
+        status, error, body = None, None, ""
+        for attempt in range(self.retries):
+            async with self.sem:
+                start = time.monotonic()
+                try:
+                    async with session.post(url, json=payload, headers=self.headers, timeout=self.timeout) as resp:
+                        status, error = resp.status, None
+                        body = await resp.text()
+                except Exception as e:
+                    status, error = None, e
+                self._observe(f"{label}{status or 'error'}", time.monotonic() - start)
+
+            if status is not None and status < 500: break
+            if attempt < self.retries - 1:
+                await asyncio.sleep(self._backoff(attempt))
+        return status, error, body
+
+    async def post(self, session, payload):
+        """返回 (success, resp)，resp 为 "" / "Exists" / "HTTP xxx" / "NetErr" / "MaxRetries" """
+        status, error, _ = await self._send(session, self.url, payload)
+        if status == 200: return True, ""
+        if status == 400: return False, "Exists"
+        if status is not None and status < 500: return False, f"HTTP {status}"
+        if error is not None:
+            if self.logger: self.logger.error(f"API Network Error: {error}")
+            return False, "NetErr"
+        return False, "MaxRetries"
+
+    @staticmethod
+    def share_line(payload):
+        """导入格式与 shares.txt 一致: path  type:code  folderId  password。
+        字段以两个空格分隔，path 中的连续空白 (含换行) 压缩为一个空格，避免拆错字段或断行"""
+        folder = payload.get('folderId') or ('root' if payload['type'] == 9 else '0')
+        path = re.sub(r'\s+', ' ', payload['path']).strip()
+        return f"{path}  {payload['type']}:{payload['shareId']}  {folder}  {payload.get('password') or ''}"
+
+    async def post_bulk(self, session, payloads):
+        """整块导入成功返回接口报告的导入条数；
+        接口不可用、失败或返回内容不是导入条数时返回 None，由调用方逐条回退"""
+        if not self.import_url or not self.bulk_available: return None
+        content = "\n".join(self.share_line(p) for p in payloads)
+        status, error, body = await self._send(session, self.import_url, {"content": content}, label="bulk ")
+        if status == 200:
+            try: imported = json.loads(body)
+            except ValueError: imported = None
+            if isinstance(imported, int) and not isinstance(imported, bool): return imported
+            # 无法确认导入了哪些行，不能整块按成功记录
+            if self.logger: self.logger.error(f"Bulk Import Unexpected Response {body[:100]!r}, falling back to single POST")
+            return None
+        if status in (404, 405):
+            # 旧版本没有批量导入接口，之后直接逐条推送
+            self.bulk_available = False
+        if self.logger: self.logger.error(f"Bulk Import Failed [{status or error}], falling back to single POST")
+        return None
+
+    def _quantile(self, counts, q):
+        target = q * sum(counts)
+        running = 0
+        for i, n in enumerate(counts):
+            running += n
+            if running >= target:
+                return f"<{self.LATENCY_BUCKETS[i]}s" if i < len(self.LATENCY_BUCKETS) else f">{self.LATENCY_BUCKETS[-1]}s"
+
+    def summary(self):
+        """按状态码汇总: 次数及 p50 / p95 所在的延迟区间"""
+        parts = []
+        for status, counts in sorted(self.histograms.items(), key=lambda kv: str(kv[0])):
+            parts.append(f"{status} n={sum(counts)} p50{self._quantile(counts, 0.5)} p95{self._quantile(counts, 0.95)}")
+        return ", ".join(parts)
+
+    def reset_counters(self):
+        self.histograms = {}
+
+
 def get_channel_id(url):
     return re.sub(r'[^\w\-]', '_', re.sub(r'https?://', '', url))[:50]
 
+RULE_KEY_FIELDS = ('folder_prefix', 'priority_keywords', 'required_keywords', 'optional_keywords', 'excluded_keywords')
+
+def get_rule_key(cfg):
+    """规则指纹: 只取影响匹配结果的字段，改名或调整顺序不会触发重新分类"""
+    data = json.dumps({k: cfg.get(k) for k in RULE_KEY_FIELDS}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
 class CloudMonitor:
+    # 全局搜索日期下界的余量 (秒)，余量内的结果会重复拉取，由 (频道, 关键词) msg_id 高水位去重
+    SEARCH_MARK_MARGIN = 300
+
     def __init__(self):
         # 此时全局配置变量应该已经被 load_global_config() 初始化
-        self.db = SQLiteManager(SAVE_PATH) 
+        self.db = AsyncSQLiteManager(SAVE_PATH) 
+        self.loop_lag = LoopLagProbe()
+        self.metrics = Metrics()
         self.client = None
-        self.sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS) 
+        self.limiter = RateLimiter(TG_RATE_LIMIT)
         self.session_sent_links = set()
+        # 关键词匹配器在配置加载后一次性编译
+        self.exclude_matcher = KeywordMatcher(EXCLUDE_KEYWORDS)
+        self.rule_matcher = RuleMatcher(API_CONFIGS)
+        self.link_scanner = LinkScanner.from_switches()
+        self.priority_keywords = self._merge_priority_keywords()
+        self.search_stats = {'requests': 0, 'naive': 0, 'results': 0, 'scanned': 0}
+        self._channel_peers = {}
+        self._channel_entities = {}
+        self.archive = MessageArchive(os.path.join(SAVE_PATH, 'archive')) if ARCHIVE_MESSAGES else None
+        self.extract_pool = self._create_extract_pool() if EXTRACT_WORKERS > 0 else None
+        self.extract_cache = ExtractCache(EXTRACT_CACHE_SIZE) if EXTRACT_CACHE_SIZE > 0 else None
         self._init_logging()
+        self.push_client = PushClient(ALIST_URL, ALIST_KEY, MAX_CONCURRENT_REQUESTS, self.logger, import_url=IMPORT_URL)
+
+    @staticmethod
+    def _merge_priority_keywords():
+        """合并所有规则的 priority_keywords: {keyword: [api_idx, ...]}，同一关键词每轮只搜索一次"""
+        merged = {}
+        for api_idx, cfg in enumerate(API_CONFIGS):
+            for keyword in cfg.get('priority_keywords', []):
+                idxs = merged.setdefault(keyword, [])
+                if api_idx not in idxs: idxs.append(api_idx)
+        return merged
+
+    @staticmethod
+    def _create_extract_pool():
+        # 使用 spawn: 主进程已有数据库线程，fork 出的子进程可能继承被占用的锁；
+        # 子进程按当前配置构建自己的匹配器，之后每批只传输消息文本
+        providers = [p for p in CLOUD_PROVIDERS if globals()[p[3]]]
+        return ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_extract_worker, initargs=(providers, EXCLUDE_KEYWORDS, API_CONFIGS, EXTRACT_CACHE_SIZE))
+
+    def close(self):
+        """提交数据库写入并关闭提取进程池 (可重复调用)"""
+        self.db.close()
+        if self.extract_pool is not None:
+            self.extract_pool.shutdown(wait=True, cancel_futures=True)
+            self.extract_pool = None
 
     def _init_logging(self):
         if SAVE_PATH and not os.path.exists(SAVE_PATH): 
@@ -342,7 +1687,7 @@ class CloudMonitor:
             self.logger.addHandler(handler)
 
     async def start(self):
-        self.db.cleanup_old_records(DB_RETENTION_DAYS) 
+        await self.db.cleanup_old_records(DB_RETENTION_DAYS) 
         
         proxy_params = None
         if ENABLE_PROXY: 
@@ -363,35 +1708,101 @@ class CloudMonitor:
             if proxy_params: client_params['proxy'] = proxy_params
             self.client = TelegramClient(**client_params)
             await self.client.start()
+            # FloodWait 不再由 Telethon 内部静默等待，统一交给共享的 RateLimiter 处理
+            self.client.flood_sleep_threshold = 0
+            self.client = RateLimitedClient(self.client, self.limiter)
         except Exception as e:
             print(f"Connect Failed: {e}")
             self.logger.error(f"Telegram Connect Failed: {e}")
-            self.db.close()
+            self.close()
             return
 
         try:
-            async with aiohttp.ClientSession() as session:
-                if LOOP_SWITCH == 1: 
-                    while True:
-                        self.session_sent_links.clear() 
+            async with self.push_client.create_session() as session:
+                # outbox 重试与扫描并行，上次进程遗留的记录在启动时继续推送
+                outbox_worker = asyncio.create_task(self.drain_outbox(session))
+                try:
+                    if LOOP_SWITCH == 1: 
+                        while True:
+                            self.session_sent_links.clear() 
+                            await self.run_cycle(session)
+                            await asyncio.sleep(MONITOR_INTERVAL_HOURS * 3600) 
+                    else:
                         await self.run_cycle(session)
-                        await asyncio.sleep(MONITOR_INTERVAL_HOURS * 3600) 
-                else:
-                    await self.run_cycle(session)
+                        # 单次运行: 扫描中失败的推送在退出前按退避时间重试，最多等待 OUTBOX_DRAIN_SECONDS
+                        outbox_worker.cancel()
+                        try: await outbox_worker
+                        except asyncio.CancelledError: pass
+                        await self.drain_outbox(session, deadline=time.time() + OUTBOX_DRAIN_SECONDS)
+                finally:
+                    outbox_worker.cancel()
+                    try: await outbox_worker
+                    except asyncio.CancelledError: pass
         finally:
             await self.client.disconnect()
-            self.db.close()
+            self.close()
 
     async def run_cycle(self, session):
+        """按 CHANNEL_CONCURRENCY 限制并发扫描所有频道，返回 {channel_url: stats}"""
         Dashboard.print_header()
-        for channel_url in CHANNEL_URLS: 
+        channel_sem = asyncio.Semaphore(CHANNEL_CONCURRENCY)
+        self.search_stats = {'requests': 0, 'naive': 0, 'results': 0, 'scanned': 0}
+        self.limiter.reset_counters()
+        self.push_client.reset_counters()
+        if self.extract_cache: self.extract_cache.reset_counters()
+        self.metrics.reset()
+        self.loop_lag.start()
+
+        async def run_one(channel_url):
+            async with channel_sem:
+                try:
+                    return await self.process_channel_unified(session, channel_url)
+                except Exception as e:
+                    Dashboard.print_message(f"❌ {channel_url} Error: {e}")
+                    self.logger.error(f"Run Cycle Error for {channel_url}: {traceback.format_exc()}")
+                    return None
+
+        # 每个频道独立统计，单个频道异常不会影响其它频道
+        results = dict(zip(CHANNEL_URLS, await asyncio.gather(*(run_one(url) for url in CHANNEL_URLS))))
+
+        if PRIORITY_SEARCH_MODE == 'global':
             try:
-                await self.process_channel_unified(session, channel_url)
-                print("-" * 80)
-            except Exception as e:
-                print(f"\n❌ {channel_url} Error: {e}")
-                self.logger.error(f"Run Cycle Error for {channel_url}: {traceback.format_exc()}")
-                print("-" * 80)
+                await self.priority_search_global(session, results)
+            except Exception:
+                self.logger.error(f"Global Search Error: {traceback.format_exc()}")
+
+        await self.loop_lag.stop()
+        s = self.search_stats
+        if s['naive']:
+            scanned = f", {s['scanned']} global messages scanned" if s['scanned'] else ""
+            Dashboard.print_message(f"🔎 Priority search: {s['requests']} requests (per-rule: {s['naive']}), {s['results']} new results{scanned}")
+        limiter_summary = self.limiter.summary()
+        if limiter_summary:
+            Dashboard.print_message(f"⏱ Telegram {limiter_summary}")
+        push_summary = self.push_client.summary()
+        if push_summary:
+            Dashboard.print_message(f"📤 Push latency: {push_summary}")
+        cache_summary = self.extract_cache.summary() if self.extract_cache else ""
+        if cache_summary:
+            Dashboard.print_message(f"🧩 Extract cache: {cache_summary}")
+        outbox = await self.db.outbox_counts()
+        if outbox.get('pending') or outbox.get('in_flight') or outbox.get('failed'):
+            Dashboard.print_message(f"📮 Outbox: {outbox.get('pending', 0) + outbox.get('in_flight', 0)} queued, {outbox.get('failed', 0)} failed")
+        lag_summary = self.loop_lag.summary()
+        if lag_summary:
+            Dashboard.print_message(f"🐢 Event loop lag: {lag_summary}")
+        stage_summary = self.metrics.summary()
+        if stage_summary:
+            Dashboard.print_message(f"📊 Stages: {stage_summary}")
+
+        record = self.metrics.snapshot()
+        record.update({'loop_lag': self.loop_lag.stats(), 'telegram': self.limiter.counters,
+                       'push_latency': {str(k): v for k, v in self.push_client.histograms.items()},
+                       'priority_search': self.search_stats, 'outbox': outbox,
+                       'extract_cache': self.extract_cache.stats() if self.extract_cache else None})
+        metrics_file = os.path.join(SAVE_PATH, "189api_metrics.jsonl") if SAVE_PATH else "189api_metrics.jsonl"
+        await asyncio.to_thread(Metrics.write, metrics_file, record)
+        return results
 
     async def process_channel_unified(self, session, channel_url):
         channel_name = channel_url.split('/')[-1]
@@ -402,97 +1813,394 @@ class CloudMonitor:
         stats['special'] = {'found': 0, 'added': 0}
 
         start_time = datetime.now()
-        Dashboard.print_channel_frame(channel_name, 0, 0, stats, start_time)
+        channel_clock = time.perf_counter()
+        channel_metrics = self.metrics.channel(channel_id)
+        Dashboard.print_channel_frame(channel_name, 0, 0, stats, start_time, key=channel_id)
 
         try:
             any_try_join = any(cfg.get('try_join', False) for cfg in API_CONFIGS) 
-            entity = await self.get_entity_safe(channel_url, any_try_join)
+            with self.metrics.timer('resolve'):
+                entity = await self.get_entity_safe(channel_url, any_try_join)
             
             if not entity:
-                Dashboard.print_channel_frame(channel_name, -1, -1, stats, start_time, is_final=True)
+                Dashboard.print_channel_frame(channel_name, -1, -1, stats, start_time, is_final=True, key=channel_id)
                 self.logger.error(f"Channel not found or cannot join: {channel_url}")
-                return
+                return stats
+            self._channel_peers[utils.get_peer_id(entity, add_mark=False)] = channel_url
+            self._channel_entities[channel_url] = entity
 
             # --- Phase 1: Standard Scan ---
+            # 生产者/消费者流水线: 拉取到的消息按 SCAN_CHUNK_SIZE 分块送入有界队列，
+            # 消费者边拉取边过滤、提取和推送，队列满时拉取自动等待
             min_date = datetime.now(timezone.utc) - timedelta(days=MONITOR_DAYS) 
-            messages = []
+            chunk = []
             fetch_count = 0
             consecutive_old_count = 0 
+            newest_id = 0
+
+            # 增量模式从上次记录的高水位之后拉取，只传输新消息；没有记录时等同完整扫描
+            last_msg_id = 0
+            with self.metrics.timer('db_read'):
+                if SCAN_MODE != 'full':
+                    last_msg_id, _ = await self.db.get_channel_state(channel_id)
+
+                # 已处理 ID 每轮加载一次，扫描循环中不再逐条查询数据库
+                processed_ids = await self.db.load_processed_ids(channel_id, last_msg_id)
+            if len(processed_ids) >= 100000:
+                Dashboard.print_message(f"ℹ️ {channel_name}: {len(processed_ids)} processed ids loaded, {processed_ids.nbytes / 1024 / 1024:.1f} MB")
+
+            batch_queue = asyncio.Queue(maxsize=2)
+            consumer = asyncio.create_task(self._consume_message_chunks(batch_queue, session, channel_name, channel_id, stats, start_time))
             
+            # fetch 只统计等待 iter_messages 返回的时间，不含入队等待
+            fetch_seconds = 0.0
+            fetch_clock = time.perf_counter()
+            scan_complete = False
             try:
-                async for msg in self.client.iter_messages(entity, limit=MONITOR_LIMIT): 
+                async for msg in self.client.iter_messages(entity, limit=MONITOR_LIMIT, min_id=last_msg_id): 
+                    fetch_seconds += time.perf_counter() - fetch_clock
                     if msg.date < min_date: break
+                    newest_id = max(newest_id, msg.id)
                     
-                    if self.db.is_msg_processed(channel_id, msg.id):
+                    if msg.id in processed_ids:
                         consecutive_old_count += 1
                         if consecutive_old_count >= SMART_STOP_COUNT: break 
                     else:
                         consecutive_old_count = 0
 
-                    messages.append(msg)
+                    chunk.append(msg)
                     fetch_count += 1
+                    if len(chunk) >= SCAN_CHUNK_SIZE:
+                        await batch_queue.put((fetch_count - len(chunk), chunk))
+                        chunk = []
                     if fetch_count % 50 == 0:
-                        Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time)
+                        Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time, key=channel_id)
+                    fetch_clock = time.perf_counter()
+                scan_complete = True
                         
             except ChannelPrivateError: 
                 self.logger.error(f"Access Denied (Private) for channel: {channel_url}")
-            
-            if messages:
-                await self._process_message_batch(session, messages, channel_name, channel_id, stats, start_time)
+                self.db.invalidate_entity(channel_url)
+            finally:
+                self.metrics.add_time('fetch', fetch_seconds, fetch_count)
+                channel_metrics['fetched'] += fetch_count
+                if chunk: await batch_queue.put((fetch_count - len(chunk), chunk))
+                await batch_queue.put(None)
+                failed_id = await consumer
+
+            # 处理失败的块不能被高水位越过，否则增量扫描再也不会拉取这些消息；
+            # 拉取中途被拒绝访问时更早的消息还没拉取，高水位保持不变
+            if failed_id is not None:
+                newest_id = min(newest_id, failed_id - 1)
+            if newest_id and scan_complete:
+                self.db.update_channel_state(channel_id, newest_id)
+                await self.db.flush()
 
             # --- Phase 2: Priority Search ---
-            Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time)
+            # global 模式下由 run_cycle 在所有频道扫描完成后统一搜索
+            Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time, key=channel_id)
+            if PRIORITY_SEARCH_MODE != 'global':
+                await self.priority_search_channel(session, entity, channel_name, channel_id, stats, start_time)
 
-            for api_idx, cfg in enumerate(API_CONFIGS): 
-                priorities = cfg.get('priority_keywords', [])
-                if not priorities: continue
-                
-                for keyword in priorities:
-                    search_msgs = []
-                    try:
-                        async for msg in self.client.iter_messages(entity, search=keyword, limit=500):
-                            search_msgs.append(msg)
-                    except Exception as e:
-                        self.logger.error(f"Search Error '{keyword}': {e}")
-                    
-                    if search_msgs:
-                        await self._process_message_batch(
-                            session, search_msgs, channel_name, channel_id, stats, start_time, 
-                            restrict_to_api_idx=api_idx
-                        )
-
-            Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time, is_final=True)
+            Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time, is_final=True, key=channel_id)
 
         except Exception as e:
             self.logger.error(f"Process Channel Error {channel_name}: {traceback.format_exc()}")
-            Dashboard.print_channel_frame(channel_name, -1, -1, stats, start_time, is_final=True)
+            # 只有频道解析类错误说明缓存的 access hash 已失效，下一轮重新解析；网络等其它错误保留缓存
+            if isinstance(e, (ChannelPrivateError, ChannelInvalidError, ValueError)):
+                self.db.invalidate_entity(channel_url)
+            Dashboard.print_channel_frame(channel_name, -1, -1, stats, start_time, is_final=True, key=channel_id)
+        channel_metrics['seconds'] += time.perf_counter() - channel_clock
+        channel_metrics['pushed'] += sum(stats[idx]['added'] for idx in range(len(API_CONFIGS)))
+        return stats
 
-    async def _process_message_batch(self, session, messages, channel_name, channel_id, stats, start_time, restrict_to_api_idx=None):
-        tasks = []
-        msgs_to_save = []
-        now_ts = time.time()
-        
-        current_idx = 0
-        total_len = len(messages)
+    async def _search_state(self, channel_id):
+        # full 模式忽略高水位，与 Phase 1 一致
+        return await self.db.get_search_state(channel_id) if SCAN_MODE != 'full' else {}
 
-        for msg in messages:
-            current_idx += 1
-            if current_idx % 20 == 0:
-                Dashboard.print_channel_frame(channel_name, total_len, current_idx, stats, start_time)
+    async def _search_marks(self, channel_id):
+        return await self.db.get_search_marks(channel_id) if SCAN_MODE != 'full' else {}
+
+    @staticmethod
+    def _search_pages(fetched):
+        """搜索实际发出的请求数: Telethon 每页最多 100 条，没有结果时也需要一次请求"""
+        return max(1, (fetched + 99) // 100)
+
+    async def _process_search_results(self, session, msgs, keyword, channel_name, channel_id, stats, start_time, advance=True):
+        """搜索结果按共享该关键词的每条规则分别处理，并推进 (频道, 关键词) 高水位。
+        advance=False 用于中断的搜索: 结果照常处理，但更早的结果还没拉取，高水位保持不变"""
+        self.search_stats['results'] += len(msgs)
+        for api_idx in self.priority_keywords[keyword]:
+            await self._process_message_batch(
+                session, msgs, channel_name, channel_id, stats, start_time,
+                restrict_to_api_idx=api_idx
+            )
+        if advance: self.db.update_search_state(channel_id, keyword, max(m.id for m in msgs))
+
+    async def priority_search_channel(self, session, entity, channel_name, channel_id, stats, start_time):
+        """逐频道搜索优先关键词: 关键词跨规则去重，只请求上次搜索之后的新消息"""
+        last_ids = await self._search_state(channel_id)
+        self.search_stats['naive'] += sum(len(idxs) for idxs in self.priority_keywords.values())
+
+        for keyword in self.priority_keywords:
+            await self._search_channel_keyword(session, entity, keyword, last_ids.get(keyword, 0), channel_name, channel_id, stats, start_time)
+
+    async def _search_channel_keyword(self, session, entity, keyword, min_id, channel_name, channel_id, stats, start_time):
+        """在单个频道中搜索一个关键词并处理结果，搜索完整结束时返回 True"""
+        search_msgs = []
+        complete = False
+        try:
+            with self.metrics.timer('search'):
+                async for msg in self.client.iter_messages(entity, search=keyword, limit=500, min_id=min_id):
+                    search_msgs.append(msg)
+            complete = True
+        except Exception as e:
+            # 搜索中断时不推进高水位，下一轮重新搜索
+            self.logger.error(f"Search Error '{keyword}': {e}")
+            search_msgs = []
+        finally:
+            self.search_stats['requests'] += self._search_pages(len(search_msgs))
+
+        if search_msgs:
+            await self._process_search_results(session, search_msgs, keyword, channel_name, channel_id, stats, start_time)
+        return complete
+
+    async def priority_search_global(self, session, results):
+        """全局搜索优先关键词: 每个关键词一次 SearchGlobal，结果按监控频道分组处理。
+
+        SearchGlobal 不能限定会话，也不能指定最早日期 (Telethon 固定 min_date=None)，结果包含账号加入的所有会话。
+        每次完整搜索后按 (频道, 关键词) 记录已覆盖到的时间 (search_marks)，下一轮结果早于这些频道的下界即停止拉取，
+        只传输上次搜索之后的新结果。没有下界的频道 (新加入监控、首次使用 global 模式或 full 模式)
+        先逐频道搜索该关键词，完成后再由全局搜索覆盖。search_stats 中 scanned 为拉取的全局消息数。
+        """
+        peers = {pid: url for pid, url in self._channel_peers.items() if results.get(url) is not None}
+        if not peers or not self.priority_keywords: return
+
+        channels = {url: (url.split('/')[-1], get_channel_id(url)) for url in peers.values()}
+        last_ids = {url: await self._search_state(cid) for url, (_, cid) in channels.items()}
+        marks = {url: await self._search_marks(cid) for url, (_, cid) in channels.items()}
+        self.search_stats['naive'] += len(peers) * sum(len(idxs) for idxs in self.priority_keywords.values())
+        min_date = datetime.now(timezone.utc) - timedelta(days=MONITOR_DAYS)
+        start_time = datetime.now()
+        frames = set()
+        # process_channel_unified 已记录扫描阶段的推送数，这里只把全局搜索新增的部分计入频道指标
+        added_before = {url: sum(results[url][idx]['added'] for idx in range(len(API_CONFIGS))) for url in channels}
+
+        for keyword in self.priority_keywords:
+            # 本轮搜索开始的时间减去余量 (容忍本机与 Telegram 服务器的时钟偏差)，完整搜索后记为新的下界
+            covered = time.time() - self.SEARCH_MARK_MARGIN
+            covered_urls = []
+            marked = {url for url in channels if keyword in marks[url]}
+
+            for url in channels:
+                if url in marked: continue
+                channel_name, channel_id = channels[url]
+                frame = f"🔎 {channel_name}"
+                frames.add((frame, url))
+                if await self._search_channel_keyword(session, self._channel_entities[url], keyword, last_ids[url].get(keyword, 0),
+                                                      frame, channel_id, results[url], start_time):
+                    covered_urls.append(url)
+            if not marked:
+                if covered_urls: self.db.update_search_marks([channels[url][1] for url in covered_urls], keyword, covered)
+                continue
+
+            since = max(min_date.timestamp(), min(marks[url][keyword] for url in marked))
+            grouped = {}
+            scanned = 0
+            complete = False
+            try:
+                # 全局结果按时间倒序返回，早于下界 (或超出 MONITOR_DAYS) 即停止，不再请求更早的分页
+                with self.metrics.timer('search'):
+                    async for msg in self.client.iter_messages(None, search=keyword, limit=500 * len(marked)):
+                        scanned += 1
+                        if msg.date.timestamp() < since: break
+                        url = peers.get(getattr(msg.peer_id, 'channel_id', None))
+                        if url not in marked or msg.id <= last_ids[url].get(keyword, 0): continue
+                        grouped.setdefault(url, []).append(msg)
+                complete = True
+                covered_urls.extend(marked)
+            except Exception as e:
+                # 已拉取的结果照常处理，更早的结果下一轮重新搜索
+                self.logger.error(f"Global Search Error '{keyword}': {e}")
+            finally:
+                self.search_stats['requests'] += self._search_pages(scanned)
+                self.search_stats['scanned'] += scanned
+
+            for url, msgs in grouped.items():
+                channel_name, channel_id = channels[url]
+                frame = f"🔎 {channel_name}"
+                frames.add((frame, url))
+                await self._process_search_results(session, msgs, keyword, frame, channel_id, results[url], start_time, advance=complete)
+            if covered_urls: self.db.update_search_marks([channels[url][1] for url in covered_urls], keyword, covered)
+
+        for url, (_, channel_id) in channels.items():
+            self.metrics.channel(channel_id)['pushed'] += sum(results[url][idx]['added'] for idx in range(len(API_CONFIGS))) - added_before[url]
+
+        for frame, url in sorted(frames):
+            Dashboard.print_channel_frame(frame, MONITOR_LIMIT, MONITOR_LIMIT, results[url], start_time, is_final=True, key=channels[url][1])
+
+    async def reclassify(self, session):
+        """重新分类: 不访问 Telegram，用 MessageArchive 中的历史消息重新执行规则匹配，
+        只推送 sent_links 中还没有的 (链接, 规则)。
+
+        每条规则按 (频道, 规则指纹) 记录已处理过的归档 msg_id 区间，只处理区间之外的消息，
+        新增或修改一条规则时只有这条规则需要遍历整个归档。返回 {channel_id: stats}。
+        """
+        archive = self.archive or MessageArchive(os.path.join(SAVE_PATH, 'archive'))
+        channel_ids = await asyncio.to_thread(archive.channels)
+        if not channel_ids:
+            Dashboard.print_message(f"⚠️ No archived messages in {archive.root}, enable ARCHIVE_MESSAGES first")
+            return {}
+        Dashboard.print_header()
+        self.metrics.reset()
+        names = {get_channel_id(url): url.split('/')[-1] for url in CHANNEL_URLS}
+        rule_keys = [get_rule_key(cfg) for cfg in API_CONFIGS]
+        results = {}
+        for channel_id in channel_ids:
+            try:
+                results[channel_id] = await self.reclassify_channel(session, archive, channel_id, names.get(channel_id, channel_id), rule_keys)
+            except Exception:
+                self.logger.error(f"Reclassify Error for {channel_id}: {traceback.format_exc()}")
+                results[channel_id] = None
+        await self.db.flush()
+        stage_summary = self.metrics.summary()
+        if stage_summary:
+            Dashboard.print_message(f"📊 Stages: {stage_summary}")
+        return results
 
-            if not msg.text: continue
+    async def reclassify_channel(self, session, archive, channel_id, channel_name, rule_keys):
+        stats = {idx: {'found': 0, 'added': 0} for idx in range(len(API_CONFIGS))}
+        stats['special'] = {'found': 0, 'added': 0}
+        start_time = datetime.now()
+        frame = f"♻️ {channel_name}"
+
+        # 处理前的归档区间: 本轮结束后各规则只把这些区间记为已处理，
+        # 之后补进归档的消息 (即使 id 落在两个区间之间) 下次仍会重新分类
+        covered = await asyncio.to_thread(archive.covered, channel_id)
+        state = await self.db.get_rule_state(channel_id)
+        ranges = [state.get(key, []) for key in rule_keys]
+
+        # 只读取至少一条规则还没处理过的部分，即所有规则区间交集之外的 id
+        common = ranges[0]
+        for r in ranges[1:]:
+            common = [(max(a[0], b[0]), min(a[1], b[1])) for a in common for b in r if max(a[0], b[0]) <= min(a[1], b[1])]
+        spans, prev = [], 0
+        for lo, hi in sorted(common):
+            if lo - 1 > prev: spans.append((prev, lo - 1))
+            prev = max(prev, hi)
+        spans.append((prev, None))
+
+        total = await asyncio.to_thread(archive.count, channel_id)
+        done = 0
+        for lo, hi in spans:
+            it = archive.iter_messages(channel_id, lo, hi)
+            while True:
+                with self.metrics.timer('archive_read'):
+                    chunk = await asyncio.to_thread(lambda: list(islice(it, SCAN_CHUNK_SIZE)))
+                if not chunk: break
+                # 同一块中待处理的规则可能不同，按规则集合分组处理
+                groups = {}
+                for msg in chunk:
+                    pending = frozenset(idx for idx, r in enumerate(ranges) if not any(lo <= msg.id <= hi for lo, hi in r))
+                    if pending: groups.setdefault(pending, []).append(msg)
+                for pending, msgs in groups.items():
+                    await self._process_message_batch(session, msgs, frame, channel_id, stats, start_time,
+                                                      progress_total=total, progress_offset=done, pending_rules=pending)
+                done += len(chunk)
+
+        # 全部规则都已处理过开始时的归档
+        if covered:
+            self.db.update_rule_state(channel_id, rule_keys, covered)
+        Dashboard.print_channel_frame(frame, total, total, stats, start_time, is_final=True, key=channel_id)
+        self.metrics.channel(channel_id)['pushed'] += sum(stats[idx]['added'] for idx in range(len(API_CONFIGS)))
+        return stats
+
+    async def run_reclassify(self):
+        """命令行 --reclassify 入口: 只需要 Alist 配置，推送失败的记录留在 outbox 由下次监控继续重试"""
+        try:
+            async with self.push_client.create_session() as session:
+                await self.reclassify(session)
+        finally:
+            self.close()
+
+    async def _consume_message_chunks(self, batch_queue, session, channel_name, channel_id, stats, start_time):
+        """Phase 1 消费者: 逐块处理队列中的消息，收到 None 结束。
+        返回处理失败的块中最小的 msg_id (没有失败时为 None)，高水位不能越过它"""
+        failed_id = None
+        while True:
+            item = await batch_queue.get()
+            if item is None: return failed_id
+            offset, chunk = item
+            if self.archive:
+                try:
+                    rows = [MessageArchive.to_row(m) for m in chunk]
+                    with self.metrics.timer('archive', len(rows)):
+                        await asyncio.to_thread(self.archive.append, channel_id, rows)
+                except Exception:
+                    self.logger.error(f"Archive Error {channel_name}: {traceback.format_exc()}")
+            try:
+                await self._process_message_batch(session, chunk, channel_name, channel_id, stats, start_time,
+                                                  progress_total=MONITOR_LIMIT, progress_offset=offset)
+            except Exception:
+                self.logger.error(f"Process Chunk Error {channel_name}: {traceback.format_exc()}")
+                lowest = min(m.id for m in chunk)
+                failed_id = lowest if failed_id is None else min(failed_id, lowest)
+
+    async def _process_message_batch(self, session, messages, channel_name, channel_id, stats, start_time, restrict_to_api_idx=None,
+                                     progress_total=None, progress_offset=0, pending_rules=None):
+        """pending_rules: 重新分类时只为这些规则推送，其余规则照常参与匹配 (先匹配的规则优先)，
+        但命中时视为之前已经处理过"""
+        pushes = []
+        parsed = []
+        now_ts = time.time()
+        
+        # 分块处理时，进度按整个扫描显示
+        current_idx = progress_offset
+        total_len = progress_total or len(messages)
+        channel_metrics = self.metrics.channel(channel_id)
+        filter_clock = time.perf_counter()
+        extract_seconds = 0.0
+        extract_count = 0
+
+        if self.extract_pool is not None:
+            # 过滤、提取和关键词扫描在子进程中完成，事件循环只等待结果
+            with self.metrics.timer('extract', len(messages)):
+                extracted = await self._extract_in_pool(messages)
+            for i, cloud_infos, kw_hits in extracted:
+                parsed.append((progress_offset + i + 1, messages[i], cloud_infos, kw_hits))
+            Dashboard.print_channel_frame(channel_name, total_len, progress_offset + len(messages), stats, start_time, key=channel_id)
+        else:
+            for msg in messages:
+                current_idx += 1
+                if current_idx % 20 == 0:
+                    Dashboard.print_channel_frame(channel_name, total_len, current_idx, stats, start_time, key=channel_id)
 
-            is_spam = False
-            for kw in EXCLUDE_KEYWORDS: 
-                if kw in msg.text: 
-                    is_spam = True; break
-            if is_spam: continue
+                if not msg.text: continue
 
-            cloud_infos = self.extract_links(msg)
-            if not cloud_infos: continue
-            
-            msgs_to_save.append((channel_id, msg.id, 0, now_ts))
+                if self.exclude_matcher.search(msg.text): continue
 
+                extract_clock = time.perf_counter()
+                cloud_infos = self.extract_links(msg)
+                extract_seconds += time.perf_counter() - extract_clock
+                extract_count += 1
+                if not cloud_infos: continue
+                
+                parsed.append((current_idx, msg, cloud_infos, None))
+
+            self.metrics.add_time('extract', extract_seconds, extract_count)
+            self.metrics.add_time('filter', time.perf_counter() - filter_clock - extract_seconds, len(messages))
+        channel_metrics['msgs'] += len(messages)
+        channel_metrics['links'] += sum(len(infos) for _, _, infos, _ in parsed)
+
+        # 一次性批量查询本批次所有链接的推送记录，替代逐条 is_link_sent
+        with self.metrics.timer('db_read'):
+            sent_pairs = await self.db.get_sent_links(info['link'] for _, _, infos, _ in parsed for info in infos)
+
+        match_clock = time.perf_counter()
+        # processed_msgs 每条消息一行，api_index 为第一个命中的规则，没有命中时为 0
+        matched = {}
+        for current_idx, msg, cloud_infos, kw_hits in parsed:
+            if kw_hits is None: kw_hits = self.rule_matcher.hits(msg.text)
             for info in cloud_infos:
                 matched_rule = False 
                 
@@ -504,26 +2212,27 @@ class CloudMonitor:
                     
                     # 避免重复推送
                     if (info['link'], api_idx) in self.session_sent_links:
-                        matched_rule = True; break
+                        matched_rule = True; matched.setdefault(msg.id, api_idx); break
 
-                    if self.db.is_link_sent(info['link'], api_idx): 
-                        matched_rule = True; break
+                    if (info['link'], api_idx) in sent_pairs: 
+                        matched_rule = True; matched.setdefault(msg.id, api_idx); break
 
                     # 检查关键词是否匹配当前规则
-                    is_priority_hit = self.check_api_keywords(msg.text, api_cfg)
+                    is_priority_hit = self.check_api_keywords(kw_hits, api_idx)
                     if not is_priority_hit: continue
 
                     # 检查排除词
                     check_content = info['desc']
-                    if not self.check_api_excludes(check_content, api_cfg): continue
+                    if not self.check_api_excludes(check_content, api_idx): continue
 
                     matched_rule = True
+                    matched.setdefault(msg.id, api_idx)
+                    if pending_rules is not None and api_idx not in pending_rules: break
                     stats[api_idx]['found'] += 1
                     
                     # 检查是否为 'special' 命中
-                    priority_kws = api_cfg.get('priority_keywords', [])
                     is_special_hit = False
-                    if priority_kws and any(k in msg.text for k in priority_kws):
+                    if self.rule_matcher.is_priority_hit(kw_hits, api_idx):
                         stats['special']['found'] += 1
                         is_special_hit = True
 
@@ -535,81 +2244,158 @@ class CloudMonitor:
                     }
                     
                     self.session_sent_links.add((info['link'], api_idx))
-                    tasks.append(self.push_wrapper(session, payload, info, msg.id, api_idx, is_special_hit, channel_name, total_len, current_idx, stats, start_time))
+                    pushes.append((payload, info, msg.id, api_idx, is_special_hit, current_idx))
         
-        if tasks:
-            Dashboard.print_channel_frame(channel_name, total_len, total_len, stats, start_time)
-            await asyncio.gather(*tasks)
+        self.metrics.add_time('match', time.perf_counter() - match_clock, len(parsed))
+        channel_metrics['pushes'] += len(pushes)
+
+        if pushes:
+            Dashboard.print_channel_frame(channel_name, total_len, progress_offset + len(messages), stats, start_time, key=channel_id)
+            with self.metrics.timer('push', len(pushes)):
+                if PUSH_MODE == 'bulk':
+                    await self.push_bulk(session, pushes, channel_name, channel_id, total_len, stats, start_time)
+                else:
+                    await asyncio.gather(*(self.push_wrapper(session, payload, info, msg_id, api_idx, is_special_hit, channel_name, channel_id, total_len, current, stats, start_time)
+                                           for payload, info, msg_id, api_idx, is_special_hit, current in pushes))
         
-        # 批量保存已处理的消息 ID
-        self.db.bulk_add_msgs(msgs_to_save)
-
-    async def push_wrapper(self, session, payload, info, msg_id, api_idx, is_special_hit, channel_name, total, current, stats, start_time):
+        # 批量保存已处理的消息 ID，并与本批次的推送记录一起提交
+        self.db.bulk_add_msgs([(channel_id, msg.id, matched.get(msg.id, 0), now_ts) for _, msg, _, _ in parsed])
+        with self.metrics.timer('db_flush'):
+            await self.db.flush()
+
+    async def _extract_in_pool(self, messages):
+        """消息按 EXTRACT_WORKERS 均分后交给进程池，返回通过过滤且含链接的 [(消息下标, cloud_infos, kw_hits)]"""
+        rows = [(i, msg.text, msg.message if msg.message != msg.text else None,
+                 [(e.offset, e.length, e.url) for e in msg.entities or [] if isinstance(e, MessageEntityTextUrl)])
+                for i, msg in enumerate(messages) if msg.text]
+        if not rows: return []
+        size = -(-len(rows) // EXTRACT_WORKERS)
+        loop = asyncio.get_running_loop()
+        parts = await asyncio.gather(*(loop.run_in_executor(self.extract_pool, _run_extract_worker, rows[i:i + size])
+                                       for i in range(0, len(rows), size)))
+        return [item for part in parts for item in part]
+
+    async def push_wrapper(self, session, payload, info, msg_id, api_idx, is_special_hit, channel_name, channel_id, total, current, stats, start_time):
         success, resp = await self.send_to_api(session, payload)
+        self._record_push(success, resp, info, api_idx, is_special_hit, channel_name, channel_id, total, current, stats, start_time, payload)
+
+    def _record_push(self, success, resp, info, api_idx, is_special_hit, channel_name, channel_id, total, current, stats, start_time, payload=None):
         if success:
             stats[api_idx]['added'] += 1
             if is_special_hit:
                 stats['special']['added'] += 1
             self.db.add_link(info['link'], api_idx)
-            Dashboard.print_channel_frame(channel_name, total, current, stats, start_time)
-        elif resp != "Exists":
+            Dashboard.print_channel_frame(channel_name, total, current, stats, start_time, key=channel_id)
+        elif resp == "Exists":
+            # Alist-TVBox 中已存在，同样记入 sent_links，下一轮不再重复推送
+            self.db.add_link(info['link'], api_idx)
+        else:
             self.logger.error(f"Push Failed [{resp}] for {info['desc']}: {info['link']}")
+            # 写入 outbox，由 drain_outbox 在后台按退避时间重试
+            if payload is not None:
+                self.db.enqueue_outbox(info['link'], api_idx, payload, channel_name, info['desc'], resp, time.time() + self._outbox_backoff(1))
+
+    @staticmethod
+    def _outbox_backoff(attempts):
+        return min(3600, 30 * (2 ** (attempts - 1))) * random.uniform(0.8, 1.2)
+
+    async def _retry_outbox_item(self, session, row):
+        link, api_idx, payload, channel, desc, attempts = row
+        success, resp = await self.send_to_api(session, json.loads(payload))
+        attempts += 1
+        if success or resp == "Exists":
+            self.db.add_link(link, api_idx)
+            self.db.finish_outbox(link, api_idx, 'done', attempts)
+            return 'done'
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            self.logger.error(f"Outbox Gave Up [{resp}] after {attempts} attempts for {desc}: {link}")
+            self.db.finish_outbox(link, api_idx, 'failed', attempts, error=resp)
+            return 'failed'
+        self.db.finish_outbox(link, api_idx, 'pending', attempts, time.time() + self._outbox_backoff(attempts), resp)
+        return 'retry'
+
+    async def drain_outbox(self, session, deadline=None):
+        """后台重试 outbox: 每批取出不超过 MAX_CONCURRENT_REQUESTS 条到期记录 (并发受推送信号量限制)，
+        没有到期记录时休眠到下一条的重试时间 (最长 60 秒)。
+        deadline (time.time() 时间戳) 用于单次运行退出前: 只等待 deadline 之前到期的重试，没有时返回"""
+        await self.db.reset_outbox_in_flight()
+        while True:
+            rows = await self.db.claim_outbox(MAX_CONCURRENT_REQUESTS)
+            if rows:
+                results = await asyncio.gather(*(self._retry_outbox_item(session, row) for row in rows))
+                Dashboard.print_message(f"📮 Outbox: {results.count('done')} done, {results.count('retry')} retry, {results.count('failed')} failed")
+                continue
+            next_retry = await self.db.next_outbox_retry()
+            if deadline is not None and (next_retry is None or next_retry > deadline): return
+            delay = 60 if next_retry is None else min(60, max(1, next_retry - time.time()))
+            await asyncio.sleep(delay)
+
+    async def push_bulk(self, session, items, channel_name, channel_id, total, stats, start_time):
+        """按 PUSH_BATCH_SIZE 分块批量导入，失败的块逐条 POST。
+        批量接口只返回导入总数，没有逐条结果: 全部导入时每条按成功记录；导入数不足时整块逐条 POST，
+        每条按实际状态记录 (批量中已导入的返回 Exists，被拒绝的进入 outbox)。"""
+        async def push_chunk(chunk):
+            imported = await self.push_client.post_bulk(session, [item[0] for item in chunk])
+            if imported is not None and imported < len(chunk):
+                self.logger.error(f"Bulk Import {channel_name}: {imported}/{len(chunk)} lines imported, checking each line")
+            elif imported is not None:
+                for payload, info, msg_id, api_idx, is_special_hit, current in chunk:
+                    self._record_push(True, "", info, api_idx, is_special_hit, channel_name, channel_id, total, current, stats, start_time)
+                return
+            await asyncio.gather(*(self.push_wrapper(session, payload, info, msg_id, api_idx, is_special_hit, channel_name, channel_id, total, current, stats, start_time)
+                                   for payload, info, msg_id, api_idx, is_special_hit, current in chunk))
+
+        await asyncio.gather(*(push_chunk(items[i:i + PUSH_BATCH_SIZE]) for i in range(0, len(items), PUSH_BATCH_SIZE)))
 
     async def send_to_api(self, session, payload):
-        async with self.sem: 
-            headers = {"x-api-key": ALIST_KEY, "Content-Type": "application/json", "Authorization": ALIST_KEY}
-            for attempt in range(3): 
-                try:
-                    async with session.post(ALIST_URL, json=payload, headers=headers, timeout=20) as resp:
-                        if resp.status == 200: return True, ""
-                        if resp.status == 400: return False, "Exists" 
-                        if resp.status >= 500: 
-                            await asyncio.sleep(1); continue
-                        return False, f"HTTP {resp.status}"
-                except Exception as e:
-                    if attempt == 2:
-                        self.logger.error(f"API Network Error: {e}")
-                    if attempt < 2: await asyncio.sleep(1)
-                    else: return False, "NetErr"
-            return False, "MaxRetries"
+        return await self.push_client.post(session, payload)
 
     async def get_entity_safe(self, url, try_join):
-        try: return await self.client.get_entity(url)
+        max_age = ENTITY_CACHE_TTL_HOURS * 3600
+        if max_age > 0:
+            cached = await self.db.get_cached_entity(url, max_age)
+            if cached: return InputPeerChannel(*cached)
+
+        try: entity = await self.client.get_entity(url)
         except:
+            entity = None
             if '+' in url and try_join:
                 try:
                     await self.client(ImportChatInviteRequest(url.split('+')[-1]))
-                    return await self.client.get_entity(url)
+                    entity = await self.client.get_entity(url)
                 except Exception as e:
                     self.logger.error(f"Join Channel Failed {url}: {e}")
                     pass
-            return None
+            if entity is None: return None
 
-    def check_api_excludes(self, text, cfg):
-        local_exclude = cfg.get('excluded_keywords', [])
-        if local_exclude:
-            for kw in local_exclude:
-                if re.match(r'^[a-zA-Z0-9]+$', kw):
-                    if re.search(rf'\b{re.escape(kw)}\b', text, re.IGNORECASE): return False
-                else:
-                    if kw in text: return False
-        return True
+        if max_age > 0:
+            try:
+                peer = utils.get_input_peer(entity)
+                if isinstance(peer, InputPeerChannel):
+                    self.db.cache_entity(url, peer.channel_id, peer.access_hash)
+            except: pass
+        return entity
 
-    def check_api_keywords(self, text, cfg):
-        priority = cfg.get('priority_keywords', [])
-        hit_priority = False
-        if priority and any(k in text for k in priority):
-            hit_priority = True
-        
-        req = cfg.get('required_keywords', [])
-        if not hit_priority:
-            if req and not all(k in text for k in req): return False
-        
-        opt = cfg.get('optional_keywords', [])
-        if opt and not any(k in text for k in opt): return False
-        return True
+    def check_api_excludes(self, text, api_idx):
+        """命中规则排除词返回 False"""
+        return not self.rule_matcher.is_excluded(text, api_idx)
+
+    def check_api_keywords(self, hits, api_idx):
+        """hits 为 rule_matcher.hits(text) 的结果"""
+        return self.rule_matcher.check(hits, api_idx)
 
     def extract_links(self, msg):
+        """内容相同的消息直接返回缓存中的解析结果 (只读)"""
+        cache = self.extract_cache
+        if cache is None: return self._extract_links(msg)
+        key = ExtractCache.key(msg)
+        results = cache.get(key)
+        if results is None:
+            results = self._extract_links(msg)
+            cache.put(key, results)
+        return results
+
+    def _extract_links(self, msg):
         results = []
         text = msg.message.replace('%EF%BC%88', '(').replace('%EF%BC%89', ')')
         
@@ -628,25 +2414,14 @@ class CloudMonitor:
         m_pwd = RE_ACCESS_CODE.search(text)
         global_pwd = m_pwd.group(1) if m_pwd else None
         
-        patterns = []
-        if ENABLE_189: patterns.append((RE_TIANYI, 'tianyi', 9, "https://cloud.189.cn/t/")) 
-        if ENABLE_UC:  patterns.append((RE_UC, 'uc', 7, "https://drive.uc.cn/s/")) 
-        if ENABLE_123: patterns.append((RE_123, '123', 3, "https://www.123865.com/s/")) 
-        if ENABLE_115: patterns.append((RE_115, '115', 8, "https://115cdn.com/s/"))
-        if ENABLE_QUARK: patterns.append((RE_QUARK, 'quark', 5, "https://pan.quark.cn/s/"))
-
-
         items = []
-        for p, ctype, cid, prefix in patterns:
-            for m in p.finditer(text):
-                items.append({'code': m.group(1), 'type': ctype, 'tid': cid, 'prefix': prefix, 'ent': False, 'm': m})
+        for ctype, cid, prefix, code, start, url in self.link_scanner.scan(text):
+            items.append({'code': code, 'type': ctype, 'tid': cid, 'prefix': prefix, 'ent': False, 'start': start, 'match_url': url})
         if msg.entities:
             for ent in msg.entities:
                 if isinstance(ent, MessageEntityTextUrl):
-                    for p, ctype, cid, prefix in patterns:
-                        m = p.search(ent.url)
-                        if m:
-                            items.append({'code': m.group(1), 'type': ctype, 'tid': cid, 'prefix': prefix, 'ent': True, 'desc': text[ent.offset:ent.offset+ent.length], 'url': ent.url})
+                    for ctype, cid, prefix, code, _, _ in self.link_scanner.scan_url(ent.url):
+                        items.append({'code': code, 'type': ctype, 'tid': cid, 'prefix': prefix, 'ent': True, 'desc': text[ent.offset:ent.offset+ent.length], 'url': ent.url})
 
         unique_codes = set(item['code'] for item in items)
         is_multi_link = len(unique_codes) > 1
@@ -658,12 +2433,13 @@ class CloudMonitor:
             base_title = smart_title
 
         seen = set()
+        line_index = None
         for it in items:
             if it['code'] in seen: continue
             seen.add(it['code'])
             
             pwd = global_pwd
-            url_check = it.get('url', it.get('m').group(0) if not it.get('ent') else "")
+            url_check = it.get('url', it.get('match_url') if not it.get('ent') else "")
             url_pwd = RE_URL_PARAM_CODE.search(url_check)
             if url_pwd: pwd = url_pwd.group(1)
 
@@ -671,23 +2447,10 @@ class CloudMonitor:
             if it.get('ent'):
                 d = StringCleaner.clean(it['desc'])
                 if len(d) > 1: local_desc = d
-            else:
-                start = it['m'].start()
-                context = text[:start]
-                prev_lines = context.split('\n')
-                for i in range(len(prev_lines) - 1, -1, -1):
-                    line = prev_lines[i].strip()
-                    if not line: continue
-                    cleaned_line = StringCleaner.clean(line)
-                    if not cleaned_line or StringCleaner.is_junk_line(cleaned_line): continue
-                    
-                    if is_multi_link:
-                        local_desc = cleaned_line
-                        break
-                    else:
-                        if smart_title not in cleaned_line and cleaned_line not in smart_title:
-                             local_desc = cleaned_line
-                        break
+            elif is_multi_link:
+                # 单链接时 final_desc 恒为 smart_title，只有多链接才需要回溯上下文
+                if line_index is None: line_index = LineIndex(text)
+                local_desc = line_index.context_before(it['start'])
 
             if is_multi_link:
                 final_desc = f"{base_title} {local_desc}" if local_desc else base_title
@@ -704,20 +2467,72 @@ class CloudMonitor:
     def build_task_name(self, info, prefix):
         return f"{prefix}{info['desc']}_{info['code'][-4:]}"[:200]
 
+# --- 多进程提取 (EXTRACT_WORKERS > 0) ---
+
+class ExtractWorker:
+    """提取子进程中的处理器: 按主进程传入的配置构建匹配器，对一批消息执行
+    全局排除词过滤、链接提取和规则关键词扫描，与 _process_message_batch 的单进程路径结果一致"""
+
+    def __init__(self, providers, exclude_keywords, api_configs, cache_size=0):
+        self.link_scanner = LinkScanner(providers)
+        self.exclude_matcher = KeywordMatcher(exclude_keywords)
+        self.rule_matcher = RuleMatcher(api_configs)
+        # 每个子进程各自缓存，命中统计不汇总到主进程
+        self.extract_cache = ExtractCache(cache_size) if cache_size > 0 else None
+
+    # 只依赖 self.link_scanner 和 self.extract_cache
+    extract_links = CloudMonitor.extract_links
+    _extract_links = CloudMonitor._extract_links
+
+    def run(self, rows):
+        results = []
+        for i, text, message, entities in rows:
+            if self.exclude_matcher.search(text): continue
+            entities = [MessageEntityTextUrl(*e) for e in entities] or None
+            cloud_infos = self.extract_links(ArchivedMessage(0, None, text if message is None else message, entities))
+            if cloud_infos: results.append((i, cloud_infos, self.rule_matcher.hits(text)))
+        return results
+
+
+_extract_worker = None
+
+def _init_extract_worker(providers, exclude_keywords, api_configs, cache_size=0):
+    global _extract_worker
+    _extract_worker = ExtractWorker(providers, exclude_keywords, api_configs, cache_size)
+
+def _run_extract_worker(rows):
+    return _extract_worker.run(rows)
+
+def _handle_sigterm(signum, frame):
+    # app.py 通过 SIGTERM 停止监控，转为 SystemExit 以便执行 finally 中的数据库提交
+    raise SystemExit(0)
+
 if __name__ == '__main__':
     # Step 1: 在启动主逻辑前，先加载配置并初始化所有全局变量
     load_global_config() 
+    # --reclassify: 用本地归档按当前规则重新分类后退出，不连接 Telegram
+    reclassify = '--reclassify' in sys.argv[1:]
     
-    if LOOP_SWITCH != 1:
+    if reclassify:
+        if not all([ALIST_URL, ALIST_KEY]):
+            print("FATAL: 重新分类需要 Alist 配置，请检查 config.json。")
+            sys.exit(1)
+    elif LOOP_SWITCH != 1:
         if not all([API_ID, API_HASH, STRING_SESSION, ALIST_URL, ALIST_KEY, CHANNEL_URLS]):
             print("FATAL: 核心配置（API/Alist/Session/频道列表）不完整，请检查 config.json。")
             sys.exit(1)
             
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     monitor = CloudMonitor()
     try: 
-        asyncio.run(monitor.start())
+        asyncio.run(monitor.run_reclassify() if reclassify else monitor.start())
     except KeyboardInterrupt: 
         print("\nStopped by user")
+    except SystemExit:
+        print("\nStopped by signal")
     except Exception as e:
         print(f"FATAL ERROR: {traceback.format_exc()}")
         monitor.logger.error(f"Monitor Crashed: {traceback.format_exc()}")
+    finally:
+        # 确保缓冲区中已确认的推送记录落盘
+        monitor.close()
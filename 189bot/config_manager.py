@@ -24,17 +24,28 @@ def load_config():
     # 返回一个包含默认结构体的配置
     default_config = {
         "TELEGRAM": {"API_ID": 0, "API_HASH": "", "STRING_SESSION": ""},
-        "ALIST": {"URL": "", "KEY": ""},
+        "ALIST": {"URL": "", "KEY": "", "PUSH_MODE": "single", "PUSH_BATCH_SIZE": 100, "IMPORT_URL": ""},
         "MONITORING": {
             "SAVE_PATH": "/app/data", 
             "LOOP_SWITCH": 2, 
             "MONITOR_INTERVAL_HOURS": 3, 
             "CHANNEL_URLS": [], 
             "MAX_CONCURRENT_REQUESTS": 10, 
+            "CHANNEL_CONCURRENCY": 3, 
             "MONITOR_LIMIT": 3000, 
             "MONITOR_DAYS": 365, 
             "SMART_STOP_COUNT": 50, 
-            "DB_RETENTION_DAYS": 30
+            "DB_RETENTION_DAYS": 30, 
+            "SCAN_MODE": "incremental", 
+            "SCAN_CHUNK_SIZE": 100, 
+            "PRIORITY_SEARCH_MODE": "channel", 
+            "TG_RATE_LIMIT": 5, 
+            "ENTITY_CACHE_TTL_HOURS": 24, 
+            "OUTBOX_MAX_ATTEMPTS": 10, 
+            "OUTBOX_DRAIN_SECONDS": 120, 
+            "ARCHIVE_MESSAGES": False, 
+            "EXTRACT_WORKERS": 0, 
+            "EXTRACT_CACHE_SIZE": 4096
         },
         "DRIVE_SWITCHES": {"ENABLE_189": True, "ENABLE_UC": False, "ENABLE_123": False},
         "FILTERING": {"EXCLUDE_KEYWORDS": ['小程序', '预告', '预感', '盈利', '即可观看', '书籍', '电子书', '图书', '丛书', '期刊','app','软件', '破解版','解锁','专业版','高级版','最新版','食谱', '免安装', '免广告','安卓', 'Android', '课程', '作品', '教程', '教学', '全书', '名著', 'mobi', 'MOBI', 'epub','任天堂','PC','单机游戏', 'pdf', 'PDF', 'PPT', '抽奖', '完整版', '有声书','读者','文学', '写作', '节课', '套装', '话术', '纯净版', '日历', 'txt', 'MP3','网赚', 'mp3', 'WAV', 'CD', '音乐', '专辑', '模板', '书中', '读物', '入门', '零基础', '常识', '电商', '小红书','JPG','短视频','工作总结', '哈哈哈哈哈', '写真','抖音', '资料', '华为', '短剧', '纪录片', '记录片', '纪录', '纪实', '学习', '付费', '小学', '初中','数学', '语文', '唐诗','魔法坏女巫','车载','DJ','合并', '演唱会', '综艺']}, 
@@ -0,0 +1,61 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cloud_monitor as cm
+import replay
+
+
+class ReplayEnv:
+    """离线回放环境: 语料与数据库都放在 tmp_path 下，CloudMonitor 推送到本地 ShareServer"""
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self._corpora = 0
+
+    def corpus(self, rows):
+        """把语料行写入临时 JSONL 并按 load_corpus 读回"""
+        self._corpora += 1
+        path = self.tmp_path / f"corpus{self._corpora}.jsonl"
+        replay.write_corpus(rows, str(path))
+        return replay.load_corpus(str(path))
+
+    def synth(self, size, channels=1, seed=1):
+        return self.corpus(replay.synth_corpus(size, channels=channels, seed=seed))
+
+    @contextlib.asynccontextmanager
+    async def monitor(self, channels, data='data', client=None, server=None, **overrides):
+        """配置回放环境并创建 CloudMonitor，产出 (monitor, session, server)。
+        同一个 data 目录在多次调用间保留数据库，overrides 覆盖 _configure 之后的全局配置"""
+        save_path = self.tmp_path / data
+        save_path.mkdir(exist_ok=True)
+        server = server or replay.ShareServer()
+        alist_url = await server.start()
+        try:
+            replay._configure(channels, str(save_path), alist_url, 'single')
+            for name, value in overrides.items():
+                setattr(cm, name, value)
+            with contextlib.redirect_stdout(io.StringIO()):
+                monitor = cm.CloudMonitor()
+                monitor.client = client or replay.ReplayClient(channels)
+                try:
+                    async with monitor.push_client.create_session() as session:
+                        yield monitor, session, server
+                finally:
+                    monitor.close()
+        finally:
+            await server.stop()
+
+
+@pytest.fixture
+def replay_env(monkeypatch, tmp_path):
+    # replay._configure 与 load_global_config 会改写模块级配置，测试结束后全部还原
+    for name, value in list(vars(cm).items()):
+        if name.isupper():
+            monkeypatch.setattr(cm, name, value)
+    return ReplayEnv(tmp_path)
@@ -0,0 +1,71 @@
+import os
+from datetime import datetime, timezone
+
+from telethon.tl.types import MessageEntityTextUrl
+
+import cloud_monitor as cm
+
+CHANNEL = 'chan'
+
+
+def _rows(ids):
+    rows = []
+    for n in ids:
+        text = f"名称：片名{n}\n\n链接：点这里"
+        entities = [MessageEntityTextUrl(len(text) - 3, 3, f"https://cloud.189.cn/t/arc{n:08d}")]
+        msg = cm.ArchivedMessage(n, datetime.fromtimestamp(1700000000 + n, timezone.utc), text, entities)
+        rows.append(cm.MessageArchive.to_row(msg))
+    return rows
+
+
+def _ids(archive, *args):
+    return [m.id for m in archive.iter_messages(CHANNEL, *args)]
+
+
+def test_round_trip_keeps_text_date_and_link_entities(tmp_path):
+    archive = cm.MessageArchive(str(tmp_path))
+    assert archive.append(CHANNEL, _rows(range(10, 0, -1))) == 10
+
+    # 新实例只读块头重建索引
+    msgs = list(cm.MessageArchive(str(tmp_path)).iter_messages(CHANNEL))
+    assert [m.id for m in msgs] == list(range(10, 0, -1))
+    msg = msgs[0]
+    assert msg.text == msg.message == "名称：片名10\n\n链接：点这里"
+    assert msg.date == datetime.fromtimestamp(1700000010, timezone.utc)
+    [entity] = msg.entities
+    assert (entity.offset, entity.length, entity.url) == (len(msg.text) - 3, 3, "https://cloud.189.cn/t/arc00000010")
+    # min_id 不含，max_id 含
+    assert _ids(archive, 3, 6) == [6, 5, 4]
+
+
+def test_appends_skip_archived_ranges_and_merge_overlapping_blocks(tmp_path):
+    archive = cm.MessageArchive(str(tmp_path))
+    archive.append(CHANNEL, _rows([30, 20, 10]))
+    # 10-30 之间已归档，只写入区间外的 40 与 5
+    assert archive.append(CHANNEL, _rows([40, 25, 5])) == 2
+    assert archive.append(CHANNEL, _rows([20, 10])) == 0
+    assert archive.covered(CHANNEL) == [(5, 40)]
+
+    # 两块的 id 范围交叠，读取时仍按 id 从新到旧输出
+    reopened = cm.MessageArchive(str(tmp_path))
+    assert _ids(reopened) == [40, 30, 20, 10, 5]
+    assert _ids(reopened, 5, 30) == [30, 20, 10]
+    assert reopened.count(CHANNEL) == 5
+    assert (reopened.min_id(CHANNEL), reopened.max_id(CHANNEL)) == (5, 40)
+
+
+def test_truncated_tail_block_is_dropped_and_overwritten(tmp_path):
+    archive = cm.MessageArchive(str(tmp_path))
+    archive.append(CHANNEL, _rows(range(10, 0, -1)))
+    archive.append(CHANNEL, _rows(range(20, 10, -1)))
+    path = os.path.join(str(tmp_path), f"{CHANNEL}.arc")
+    # 模拟写第二块时进程被杀: 文件停在第二块的数据中间
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 5)
+
+    reopened = cm.MessageArchive(str(tmp_path))
+    assert _ids(reopened) == list(range(10, 0, -1))
+    assert reopened.covered(CHANNEL) == [(1, 10)]
+    # 下次追加从最后一个完整块之后写入，不完整的块被截断
+    assert reopened.append(CHANNEL, _rows(range(20, 10, -1))) == 10
+    assert _ids(cm.MessageArchive(str(tmp_path))) == list(range(20, 0, -1))
@@ -0,0 +1,63 @@
+from telethon.tl.types import MessageEntityBold, MessageEntityTextUrl
+
+import cloud_monitor as cm
+
+
+def _msg(text, *entities):
+    return cm.ArchivedMessage(0, None, text, list(entities) or None)
+
+
+def test_lru_evicts_least_recently_used_entry():
+    cache = cm.ExtractCache(maxsize=2)
+    cache.put('a', [1])
+    cache.put('b', [2])
+    assert cache.get('a') == [1]
+    # 'a' 刚被读取过，超出容量时淘汰的是 'b'
+    cache.put('c', [3])
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == [1] and cache.get('c') == [3]
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'size': 2, 'hit_rate': 0.75}
+
+
+def test_key_covers_text_and_text_url_entities():
+    url = "https://cloud.189.cn/t/abcdefgh"
+    base = _msg("名称：片名\n链接：点这里", MessageEntityTextUrl(9, 3, url))
+    key = cm.ExtractCache.key(base)
+    assert cm.ExtractCache.key(_msg("名称：片名\n链接：点这里", MessageEntityTextUrl(9, 3, url))) == key
+    # 只有文字链接实体参与计算
+    assert cm.ExtractCache.key(_msg("名称：片名\n链接：点这里", MessageEntityTextUrl(9, 3, url), MessageEntityBold(0, 2))) == key
+
+    variants = [
+        _msg("名称：片名\n链接：点这里"),
+        _msg("名称：片名2\n链接：点这里", MessageEntityTextUrl(9, 3, url)),
+        _msg("名称：片名\n链接：点这里", MessageEntityTextUrl(8, 3, url)),
+        _msg("名称：片名\n链接：点这里", MessageEntityTextUrl(9, 2, url)),
+        _msg("名称：片名\n链接：点这里", MessageEntityTextUrl(9, 3, url + "x")),
+    ]
+    keys = {cm.ExtractCache.key(m) for m in variants}
+    assert len(keys) == len(variants) and key not in keys
+
+
+def test_key_separates_text_from_entities():
+    url = "https://cloud.189.cn/t/abcdefgh"
+    # 文本中恰好包含实体的编码形式，或 url 中包含下一个实体的编码形式 (url 带或不带长度)
+    pairs = []
+    for encoded, next_encoded in ((f"\x000:3:{url}", "\x000:1:u"), (f"\x000:3:{len(url)}:{url}", "\x000:1:1:u")):
+        pairs.append((_msg("abc", MessageEntityTextUrl(0, 3, url)), _msg("abc" + encoded)))
+        pairs.append((_msg("abc", MessageEntityTextUrl(0, 3, url), MessageEntityTextUrl(0, 1, "u")),
+                      _msg("abc", MessageEntityTextUrl(0, 3, url + next_encoded))))
+    for a, b in pairs:
+        assert cm.ExtractCache.key(a) != cm.ExtractCache.key(b)
+
+
+def test_cached_results_follow_entity_urls():
+    worker = cm.ExtractWorker(cm.CLOUD_PROVIDERS, [], cm.API_CONFIGS, cache_size=16)
+    text = "名称：片名\n链接：点这里"
+    links = []
+    for code in ("aaaaaaaaaaaa", "bbbbbbbbbbbb", "aaaaaaaaaaaa"):
+        infos = worker.extract_links(_msg(text, MessageEntityTextUrl(9, 3, f"https://cloud.189.cn/t/{code}")))
+        links.append([info['link'] for info in infos])
+    # 文本相同而链接不同的消息不共用缓存项，第三条命中第一条的缓存
+    assert links[0] != links[1] and links[0] == links[2] and links[0]
+    assert worker.extract_cache.stats()['hits'] == 1 and len(worker.extract_cache) == 2
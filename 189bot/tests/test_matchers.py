@@ -0,0 +1,109 @@
+import random
+import re
+
+import cloud_monitor as cm
+import replay as rp
+
+# 相互重叠的关键词: 前缀/后缀/包含关系、大小写变体、整词与子串、中英混排
+VOCAB = ['4K', '4k', '4K HDR', 'HDR', 'HDR10', 'PDF', 'pdf', 'PDFs', 'mp3', 'MP3', 'EP', 'EP12',
+         '电影', '电影版', '纪录', '纪录片', '记录片', '动漫', '剧集', '全集', '更新', '更新至', '预告',
+         '权力的游戏', '游戏', '绝命毒师', '毒师', 'a', 'ab', 'abc', '1080', '1080P', '#电影', '#动漫']
+FILLER = [' ', '\n', '，', '：', '_', '-', '.', 'x', '2025', '🎬', '（', '）', '/', '#']
+
+
+def random_texts(n, seed=0):
+    rnd = random.Random(seed)
+    return ["".join(rnd.choice(VOCAB + FILLER) for _ in range(rnd.randint(0, 25))) for _ in range(n)]
+
+
+def random_rules(n, seed=0):
+    rnd = random.Random(seed)
+    pick = lambda k: rnd.sample(VOCAB, rnd.randint(0, k))
+    return [{'name': f"r{i}", 'priority_keywords': pick(3), 'required_keywords': pick(3),
+             'optional_keywords': pick(3), 'excluded_keywords': pick(4)} for i in range(n)]
+
+
+def test_keyword_matcher_matches_substring_loops():
+    rnd = random.Random(1)
+    for text in random_texts(2000):
+        keywords = rnd.sample(VOCAB, rnd.randint(0, 12))
+        matcher = cm.KeywordMatcher(keywords)
+        assert matcher.search(text) == rp.legacy_is_excluded(text, keywords)
+        assert matcher.hits(text) == {k for k in keywords if k in text}
+
+
+def test_empty_keyword_always_hits_like_substring_check():
+    matcher = cm.KeywordMatcher(['', 'abc'])
+    assert matcher.search('xyz') and rp.legacy_is_excluded('xyz', ['', 'abc'])
+    assert matcher.hits('xyz') == {''}
+
+
+def test_rule_matcher_matches_legacy_checks():
+    rules = random_rules(40)
+    matcher = cm.RuleMatcher(rules)
+    for text in random_texts(2000, seed=2):
+        hits = matcher.hits(text)
+        for i, cfg in enumerate(rules):
+            assert matcher.check(hits, i) == rp.legacy_check_api_keywords(text, cfg), (text, cfg)
+            assert (not matcher.is_excluded(text, i)) == rp.legacy_check_api_excludes(text, cfg), (text, cfg)
+            assert matcher.is_priority_hit(hits, i) == rp.legacy_is_priority_hit(text, cfg), (text, cfg)
+
+
+def test_word_excludes_respect_boundaries_and_case():
+    matcher = cm.ExcludeMatcher(['pdf', 'ab'])
+    for text in ['a PDF file', 'PDFs', 'abc', 'x-ab-y', '电子书pdf', 'ab']:
+        assert (not matcher.search(text)) == rp.legacy_check_api_excludes(text, {'excluded_keywords': ['pdf', 'ab']})
+
+
+def test_bench_match_agrees_on_synthetic_corpus():
+    # bench_match 在结果不一致时抛出 AssertionError
+    rules = random_rules(8, seed=3) + [{'name': 'default', 'priority_keywords': [], 'required_keywords': [],
+                                        'optional_keywords': [], 'excluded_keywords': []}]
+    rp.bench_match(rp.match_texts(500), VOCAB[:20], rules, repeat=1)
+
+
+def legacy_scan(text, providers):
+    """原来的逐个网盘 finditer"""
+    found = []
+    for ctype, tid, prefix, _, pattern, _ in providers:
+        for m in re.finditer(pattern, text, re.IGNORECASE):
+            found.append((ctype, tid, prefix, m.group(1), m.start(), m.group(0)))
+    return found
+
+
+# 可以互相粘连、嵌套的链接片段: 123 盘域名中的数字可以包含 115 的域名
+LINK_PARTS = ['https://', 'www.', 'cloud.189.cn/t/', 'drive.uc.cn/s/', '123', '123456', 'pan.123', '115', '115cdn',
+              '.com/s/', 'pan.quark.cn/s/', 'abcdefghijkl', 'x', '0', '#/list/share/', '?', '-', ' ', '\n']
+
+
+def in_domain_of_other_link(item, found):
+    """item 的起点落在另一个网盘链接的域名部分 (分享码之前)"""
+    for other in found:
+        code_start = other[4] + re.search(r'/[st]/', other[5]).end()
+        if other[0] != item[0] and other[4] < item[4] < code_start: return True
+    return False
+
+
+def test_link_scanner_skips_links_nested_in_another_domain():
+    scanner = cm.LinkScanner(cm.CLOUD_PROVIDERS)
+    text = "资源：www.123456115.com/s/x"
+    # 原来的逐个网盘扫描会把 123 盘域名的尾部当成 115 链接
+    assert {item[0] for item in legacy_scan(text, cm.CLOUD_PROVIDERS)} == {'123', '115'}
+    assert [(item[0], item[3]) for item in scanner.scan(text)] == [('123', 'x')]
+    # 紧贴在分享码后面的其它网盘链接仍然保留
+    text = "www.123456.com/s/abc115.com/s/y"
+    assert [(item[0], item[3]) for item in scanner.scan(text)] == [('123', 'abc115'), ('115', 'y')]
+
+
+def test_link_scanner_matches_per_provider_finditer():
+    rnd = random.Random(3)
+    scanner = cm.LinkScanner(cm.CLOUD_PROVIDERS)
+    for _ in range(5000):
+        text = "".join(rnd.choice(LINK_PARTS) for _ in range(rnd.randint(1, 12)))
+        legacy = legacy_scan(text, cm.CLOUD_PROVIDERS)
+        expected = [item for item in legacy if not in_domain_of_other_link(item, legacy)]
+        assert scanner.scan(text) == expected, text
+        # 实体 URL 取每个网盘第一个不在其它链接域名里的匹配
+        first = {}
+        for item in expected: first.setdefault(item[0], item)
+        assert scanner.scan_url(text) == list(first.values()), text
@@ -0,0 +1,283 @@
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone, timedelta
+
+from telethon.errors import ChannelPrivateError
+
+import cloud_monitor as cm
+import replay
+
+
+async def _run_cycle(env, channels, data, fail_ids=()):
+    """跑一轮扫描；包含 fail_ids 中任一 id 的块在处理时抛出异常"""
+    async with env.monitor(channels, data=data, SCAN_MODE='incremental') as (monitor, session, _):
+        process = monitor._process_message_batch
+
+        async def flaky(session, messages, *args, **kwargs):
+            if any(m.id in fail_ids for m in messages): raise RuntimeError("chunk failed")
+            return await process(session, messages, *args, **kwargs)
+
+        monitor._process_message_batch = flaky
+        await monitor.run_cycle(session)
+        channel_id = cm.get_channel_id(next(iter(channels)))
+        last_msg_id, _ = await monitor.db.get_channel_state(channel_id)
+        processed = await monitor.db.load_processed_ids(channel_id, 0)
+    return last_msg_id, processed
+
+
+def test_failed_chunk_holds_high_water_mark(replay_env):
+    channels = replay_env.synth(350)
+    msgs = next(iter(channels.values()))
+    newest = msgs[0].id
+    # 第二个块 (按拉取顺序) 处理失败
+    failed_chunk = msgs[cm.SCAN_CHUNK_SIZE:2 * cm.SCAN_CHUNK_SIZE]
+    failed_low = min(m.id for m in failed_chunk)
+
+    _, expected = asyncio.run(_run_cycle(replay_env, channels, 'clean'))
+    expected = {m.id for m in failed_chunk if m.id in expected}
+    assert expected
+
+    last_msg_id, _ = asyncio.run(_run_cycle(replay_env, channels, 'flaky', fail_ids={failed_chunk[0].id}))
+    assert last_msg_id < failed_low
+
+    # 下一轮增量扫描重新拉取失败的块，高水位随后推进到最新消息
+    last_msg_id, processed = asyncio.run(_run_cycle(replay_env, channels, 'flaky'))
+    assert last_msg_id == newest
+    assert all(msg_id in processed for msg_id in expected)
+
+
+class RevokedScanClient(replay.ReplayClient):
+    """扫描拉取 fail_after 条消息后频道变为私有"""
+
+    def __init__(self, channels, fail_after):
+        super().__init__(channels)
+        self.fail_after = fail_after
+
+    async def iter_messages(self, entity, **kwargs):
+        count = 0
+        async for msg in super().iter_messages(entity, **kwargs):
+            if count == self.fail_after: raise ChannelPrivateError(request=None)
+            yield msg
+            count += 1
+
+
+async def _revoked_cycle(env, channels, fail_after):
+    async with env.monitor(channels, data='revoked', client=RevokedScanClient(channels, fail_after), SCAN_MODE='incremental') as (monitor, session, _):
+        await monitor.run_cycle(session)
+        last_msg_id, _ = await monitor.db.get_channel_state(cm.get_channel_id(next(iter(channels))))
+    return last_msg_id
+
+
+def test_private_channel_mid_scan_holds_high_water_mark(replay_env):
+    channels = replay_env.synth(350)
+    # 只拉取到最新的 150 条，更早的消息下一轮仍需拉取
+    assert asyncio.run(_revoked_cycle(replay_env, channels, fail_after=150)) == 0
+    assert asyncio.run(_revoked_cycle(replay_env, channels, fail_after=None)) == next(iter(channels.values()))[0].id
+
+
+class DroppingSearchClient(replay.ReplayClient):
+    """全局搜索返回 fail_after 条结果后连接中断"""
+
+    def __init__(self, channels, fail_after):
+        super().__init__(channels)
+        self.fail_after = fail_after
+
+    async def iter_messages(self, entity, **kwargs):
+        count = 0
+        async for msg in super().iter_messages(entity, **kwargs):
+            if entity is None and count == self.fail_after: raise ConnectionError("connection dropped")
+            yield msg
+            count += 1
+
+
+async def _global_search(env, channels, fail_after):
+    client = DroppingSearchClient(channels, fail_after)
+    async with env.monitor(channels, client=client) as (monitor, session, _):
+        url = next(iter(channels))
+        channel_id = cm.get_channel_id(url)
+        monitor._channel_peers = {client.peers[url].channel_id: url}
+        monitor._channel_entities = {url: client.peers[url]}
+        monitor.priority_keywords = {'名称': [0]}
+        # 已有覆盖全部语料的日期下界，本轮直接走全局搜索
+        monitor.db.update_search_marks([channel_id], '名称', 1.0)
+        processed = []
+        process = monitor._process_search_results
+
+        async def record(session, msgs, *args, **kwargs):
+            processed.extend(m.id for m in msgs)
+            return await process(session, msgs, *args, **kwargs)
+
+        monitor._process_search_results = record
+        monitor._process_message_batch = lambda *args, **kwargs: asyncio.sleep(0)
+        stats = {idx: {'found': 0, 'added': 0} for idx in range(len(cm.API_CONFIGS))}
+        await monitor.priority_search_global(session, {url: stats})
+        state = await monitor.db.get_search_state(channel_id)
+        marks = await monitor.db.get_search_marks(channel_id)
+    return processed, monitor.search_stats, state, marks
+
+
+def test_interrupted_global_search_processes_partial_results(replay_env):
+    channels = replay_env.synth(350)
+    processed, search_stats, state, marks = asyncio.run(_global_search(replay_env, channels, fail_after=250))
+    assert len(processed) == 250
+    # 250 条结果分 3 页拉取
+    assert search_stats['requests'] == 3 and search_stats['scanned'] == 250
+    # 更早的结果没有拉取，关键词高水位与日期下界都不推进
+    assert '名称' not in state and marks == {'名称': 1.0}
+
+
+class FailingScanClient(replay.ReplayClient):
+    def __init__(self, channels, error):
+        super().__init__(channels)
+        self.error = error
+
+    async def iter_messages(self, entity, **kwargs):
+        raise self.error
+        yield
+
+
+async def _entity_cached_after(env, channels, data, error):
+    url = next(iter(channels))
+    async with env.monitor(channels, data=data, ENTITY_CACHE_TTL_HOURS=0.5) as (monitor, session, _):
+        await monitor.get_entity_safe(url, False)
+        await monitor.db.flush()
+        assert await monitor.db.get_cached_entity(url, 1800)
+        monitor.client = FailingScanClient(channels, error)
+        await monitor.process_channel_unified(session, url)
+        await monitor.db.flush()
+        return await monitor.db.get_cached_entity(url, 1800) is not None
+
+
+def test_entity_cache_dropped_only_on_resolution_errors(replay_env):
+    channels = replay_env.synth(50)
+    assert asyncio.run(_entity_cached_after(replay_env, channels, 'reset', ConnectionError("reset")))
+    assert not asyncio.run(_entity_cached_after(replay_env, channels, 'invalid', ValueError("Could not find the input entity")))
+
+
+async def _drain_before_exit(env, window):
+    async with env.monitor({'https://t.me/replay0': []}) as (monitor, session, server):
+        now = time.time()
+        # 一条在等待窗口内到期，一条要到一小时后才重试
+        for link, due in (('https://cloud.189.cn/t/soon', now + 1), ('https://cloud.189.cn/t/later', now + 3600)):
+            payload = {'path': link, 'shareId': link[-5:], 'type': 9, 'folderId': '', 'password': ''}
+            monitor.db.enqueue_outbox(link, 0, payload, 'replay0', link, 'HTTP 503', due)
+        start = time.monotonic()
+        await monitor.drain_outbox(session, deadline=time.time() + window)
+        elapsed = time.monotonic() - start
+        await monitor.db.flush()
+        counts = await monitor.db.outbox_counts()
+    return counts, elapsed, server.posts
+
+
+def test_single_run_drains_due_outbox_entries_within_window(replay_env):
+    counts, elapsed, posts = asyncio.run(_drain_before_exit(replay_env, window=10))
+    assert counts == {'done': 1, 'pending': 1} and posts == 1
+    # 窗口外的重试留给下次运行，不等到窗口结束
+    assert elapsed < 5
+
+
+def _priority_rows(per_channel=30):
+    """每个频道 per_channel 条命中优先关键词的帖子，分享码互不相同"""
+    prefix = next(p for _, tid, p, _, _, _ in cm.CLOUD_PROVIDERS if tid == 9)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for n in range(2 * per_channel):
+        rows.append({"channel": f"https://t.me/replay{n % 2}", "id": n + 1, "date": (now - timedelta(minutes=n)).isoformat(),
+                     "text": f"名称：权力的游戏 第{n}季\n\n链接：{prefix}prio{n:08d}\n\n🏷 标签：#美剧", "entities": []})
+    return rows
+
+
+async def _global_cycle(env, channels, scan_limit):
+    # 扫描阶段只拉取最新的消息，更早的优先关键词命中由全局搜索推送
+    async with env.monitor(channels, PRIORITY_SEARCH_MODE='global', MONITOR_LIMIT=scan_limit) as (monitor, session, _):
+        results = await monitor.run_cycle(session)
+    return results, monitor.metrics.snapshot()['channels'], monitor.search_stats
+
+
+def test_global_search_pushes_counted_in_channel_metrics(replay_env):
+    channels = replay_env.corpus(_priority_rows())
+    results, metrics, search_stats = asyncio.run(_global_cycle(replay_env, channels, scan_limit=20))
+    assert search_stats['results']
+    for url, stats in results.items():
+        added = sum(stats[idx]['added'] for idx in range(len(cm.API_CONFIGS)))
+        assert added > 20
+        assert metrics[cm.get_channel_id(url)]['pushed'] == added
+
+
+async def _global_rounds(env, rows, new_rows):
+    """两轮 global 模式扫描: 第一轮没有日期下界，第二轮前频道新增 new_rows"""
+    rounds = []
+    for batch in (rows, rows + new_rows):
+        channels = env.corpus(batch)
+        async with env.monitor(channels, PRIORITY_SEARCH_MODE='global') as (monitor, session, _):
+            await monitor.run_cycle(session)
+            marks = await monitor.db.get_search_marks(cm.get_channel_id(next(iter(channels))))
+        rounds.append((dict(monitor.search_stats), marks))
+    return rounds
+
+
+def test_global_search_stops_at_date_mark(replay_env):
+    now = datetime.now(timezone.utc)
+    prefix = next(p for _, tid, p, _, _, _ in cm.CLOUD_PROVIDERS if tid == 9)
+
+    def post(n, age):
+        return {"channel": "https://t.me/replay0", "id": n, "date": (now - age).isoformat(),
+                "text": f"名称：权力的游戏 第{n}集\n\n链接：{prefix}mark{n:08d}", "entities": []}
+
+    rows = [post(n, timedelta(hours=400 - n)) for n in range(1, 301)]
+    # 第一轮之后发布的帖子，晚于第一轮记录的下界 (开始时间 - SEARCH_MARK_MARGIN)
+    new_rows = [post(n, timedelta(seconds=306 - n)) for n in range(301, 306)]
+    (first, first_marks), (second, second_marks) = asyncio.run(_global_rounds(replay_env, rows, new_rows))
+
+    # 第一轮没有下界: 逐频道搜索，不做全局搜索；完成后记录下界
+    assert first['scanned'] == 0 and set(first_marks) == {'权力的游戏', '绝命毒师'}
+    # 第二轮只拉取下界之后的新结果，不再翻阅 300 条历史结果
+    assert second['scanned'] <= len(new_rows) + 1 and second['results'] == len(new_rows)
+    assert all(second_marks[kw] >= first_marks[kw] for kw in first_marks)
+
+
+async def _processed_rows(env, channels):
+    async with env.monitor(channels, data='rows') as (monitor, session, _):
+        await monitor.run_cycle(session)
+        db_file = monitor.db.db.db_file
+    with sqlite3.connect(db_file) as conn:
+        return conn.execute("SELECT msg_id, api_index FROM processed_msgs").fetchall()
+
+
+def test_processed_msgs_records_matched_rule_once(replay_env):
+    now = datetime.now(timezone.utc)
+    prefix = next(p for _, tid, p, _, _, _ in cm.CLOUD_PROVIDERS if tid == 9)
+    texts = ["名称：某电影 4K 原盘 简中", "名称：某美剧 第一季 全集", "名称：随便分享一下"]
+    rows = [{"channel": "https://t.me/replay0", "id": n + 1, "date": (now - timedelta(minutes=n)).isoformat(),
+             "text": f"{text}\n\n链接：{prefix}rows{n:08d}", "entities": []} for n, text in enumerate(texts)]
+    rows = asyncio.run(_processed_rows(replay_env, replay_env.corpus(rows)))
+    # 每条消息一行: 电影规则命中记为 1，剧集规则命中与未命中都记为 0
+    assert sorted(rows) == [(1, 1), (2, 0), (3, 0)]
+
+
+async def _reclassify_added(env, channels, *blocks):
+    """把每个 blocks 作为一块追加进归档后重新分类，返回本轮新增推送数"""
+    channel_id = cm.get_channel_id(next(iter(channels)))
+    async with env.monitor(channels, data='reclassify') as (monitor, session, _):
+        archive = cm.MessageArchive(os.path.join(cm.SAVE_PATH, 'archive'))
+        for rows in blocks:
+            archive.append(channel_id, rows)
+        stats = (await monitor.reclassify(session))[channel_id]
+    return sum(stats[idx]['added'] for idx in range(len(cm.API_CONFIGS)))
+
+
+def test_reclassify_picks_up_ids_backfilled_between_archived_ranges(replay_env):
+    now = datetime.now(timezone.utc)
+    prefix = next(p for _, tid, p, _, _, _ in cm.CLOUD_PROVIDERS if tid == 9)
+
+    def rows(ids):
+        return [cm.MessageArchive.to_row(cm.ArchivedMessage(n, now - timedelta(minutes=n), f"名称：电影{n} 4K 原盘\n\n链接：{prefix}recl{n:08d}"))
+                for n in sorted(ids, reverse=True)]
+
+    channels = {'https://t.me/replay0': []}
+    # 第一轮归档中只有 1-10 与 21-30，11-20 之后才补进归档
+    assert asyncio.run(_reclassify_added(replay_env, channels, rows(range(21, 31)), rows(range(1, 11)))) == 20
+    assert asyncio.run(_reclassify_added(replay_env, channels, rows(range(11, 21)))) == 10
+    assert asyncio.run(_reclassify_added(replay_env, channels)) == 0
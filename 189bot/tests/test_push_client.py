@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+
+from aiohttp import web
+
+import cloud_monitor as cm
+import replay
+
+
+def _payload(path, code='abcdefgh', share_type=9):
+    return {'path': path, 'shareId': code, 'type': share_type, 'folderId': '', 'password': 'x1y2'}
+
+
+def test_share_line_collapses_whitespace_in_path():
+    line = cm.PushClient.share_line(_payload(" /剧集/权力的游戏  第一季\n 4K\t内封 "))
+    assert line == "/剧集/权力的游戏 第一季 4K 内封  9:abcdefgh  root  x1y2"
+    assert "\n" not in line and len(line.split("  ")) == 4
+
+
+def test_post_bulk_returns_imported_count():
+    async def scenario():
+        server = replay.ShareServer()
+        url = await server.start()
+        client = cm.PushClient(url, 'key', 2, import_url=cm.urljoin(url, '/api/import-shares'))
+        payloads = [_payload(f"/电影/片名 {i}\n1080P", code=f"code{i}") for i in range(3)]
+        try:
+            async with client.create_session() as session:
+                first = await client.post_bulk(session, payloads)
+                # 已存在的分享不计入导入数
+                second = await client.post_bulk(session, payloads[:1] + [_payload("/电影/新片", code="new")])
+        finally:
+            await server.stop()
+        return first, second
+
+    assert asyncio.run(scenario()) == (3, 1)
+
+
+class RejectingShareServer(replay.ShareServer):
+    """标题含「坏」的分享在批量导入中被跳过，单条推送返回 422；body 不为空时批量接口直接返回该内容"""
+
+    def __init__(self, body=None):
+        super().__init__()
+        self.body = body
+
+    async def _single(self, request):
+        payload = await request.json()
+        if '坏' in payload['path']:
+            self.posts += 1
+            return web.json_response({}, status=422)
+        return await super()._single(request)
+
+    async def _bulk(self, request):
+        if self.body is not None: return web.Response(text=self.body)
+        payload = await request.json()
+        lines = [line for line in payload['content'].split('\n') if '坏' not in line]
+        return web.json_response(self.import_lines('\n'.join(lines)))
+
+
+async def _push_bulk(env, server, titles):
+    channels = {'https://t.me/replay0': []}
+    async with env.monitor(channels, server=server, PUSH_MODE='bulk') as (monitor, session, _):
+        items = []
+        for n, title in enumerate(titles):
+            info = {'link': f"https://cloud.189.cn/t/bulk{n:04d}", 'desc': title}
+            items.append((_payload(f"/剧集/{title}", code=f"bulk{n:04d}"), info, n + 1, 0, False, n + 1))
+        stats = {0: {'found': len(items), 'added': 0}, 'special': {'found': 0, 'added': 0}}
+        await monitor.push_bulk(session, items, 'replay0', 'replay0', len(items), stats, datetime.now())
+        sent = await monitor.db.get_sent_links([item[1]['link'] for item in items])
+        await monitor.db.flush()
+        outbox = await monitor.db.outbox_counts()
+    return stats, {link for link, _ in sent}, outbox, server.posts
+
+
+def test_partial_bulk_import_checks_each_line(replay_env):
+    server = RejectingShareServer()
+    stats, sent, outbox, posts = asyncio.run(_push_bulk(replay_env, server, ["好剧 1", "坏剧", "好剧 2"]))
+    # 被拒绝的一行不记入 sent_links，进入 outbox 重试；批量中已导入的两行逐条确认为 Exists
+    assert sent == {"https://cloud.189.cn/t/bulk0000", "https://cloud.189.cn/t/bulk0002"}
+    assert outbox == {'pending': 1} and posts == 3
+    assert stats[0]['added'] == 0
+
+
+def test_unparseable_bulk_response_checks_each_line(replay_env):
+    server = RejectingShareServer(body="ok")
+    stats, sent, outbox, posts = asyncio.run(_push_bulk(replay_env, server, ["好剧 1", "好剧 2"]))
+    assert sent == {"https://cloud.189.cn/t/bulk0000", "https://cloud.189.cn/t/bulk0001"}
+    assert stats[0]['added'] == 2 and posts == 2 and not outbox
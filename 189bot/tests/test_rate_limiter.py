@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from telethon.errors import FloodWaitError
+
+import cloud_monitor as cm
+
+
+class FakeClock:
+    """替换 RateLimiter 使用的 time.monotonic / asyncio.sleep，sleep 直接推进时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cm.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(cm.asyncio, 'sleep', clock.sleep)
+    return clock
+
+
+def _flood(seconds):
+    return FloodWaitError(request=None, capture=seconds)
+
+
+def test_tokens_refill_at_configured_rate(clock):
+    limiter = cm.RateLimiter(2, burst=2)
+
+    async def scenario():
+        start = clock.now
+        for _ in range(5):
+            await limiter.acquire('get_entity')
+        return clock.now - start
+
+    # 前两次消耗突发令牌，之后每 0.5 秒一个
+    assert asyncio.run(scenario()) == pytest.approx(1.5)
+    counter = limiter.counters['get_entity']
+    assert counter['calls'] == 5 and counter['waited'] == pytest.approx(1.5)
+
+
+def test_flood_wait_pauses_halves_rate_and_retries(clock):
+    limiter = cm.RateLimiter(4)
+    calls = []
+
+    async def request():
+        calls.append(clock.now)
+        if len(calls) == 1: raise _flood(30)
+        return 'ok'
+
+    assert asyncio.run(limiter.call('GetHistoryRequest', request)) == 'ok'
+    # 重试在暂停结束后发出，速率减半后按 2% 回升
+    assert calls[1] - calls[0] >= 30
+    assert limiter.rate == pytest.approx(2 + 4 * 0.02)
+    counter = limiter.counters['GetHistoryRequest']
+    assert (counter['floods'], counter['flood_wait'], counter['retries']) == (1, 30, 1)
+
+
+def test_flood_wait_gives_up_after_max_retries_or_long_waits(clock):
+    async def always_flood(seconds):
+        raise _flood(seconds)
+
+    limiter = cm.RateLimiter(4, max_retries=2, max_wait=60)
+    with pytest.raises(FloodWaitError):
+        asyncio.run(limiter.call('search', always_flood, 5))
+    assert limiter.counters['search']['floods'] == 3 and limiter.counters['search']['retries'] == 2
+    # 每次 FloodWait 速率减半，没有成功调用不回升
+    assert limiter.rate == 0.5
+
+    # 等待超过 max_wait 时直接抛出，不重试
+    limiter = cm.RateLimiter(4, max_wait=60)
+    with pytest.raises(FloodWaitError):
+        asyncio.run(limiter.call('search', always_flood, 3600))
+    assert limiter.counters['search']['retries'] == 0
+
+
+class FloodingHistory:
+    """按 id 从新到旧返回 1..total，第一次拉取到 flood_after 条时抛出 FloodWait"""
+
+    def __init__(self, total, flood_after):
+        self.total = total
+        self.flood_after = flood_after
+        self.requests = []
+
+    async def iter_messages(self, entity, limit=None, offset_id=0, **kwargs):
+        self.requests.append((limit, offset_id))
+        start = offset_id - 1 if offset_id else self.total
+        for n, msg_id in enumerate(range(start, max(0, start - (limit or start)), -1)):
+            if len(self.requests) == 1 and n == self.flood_after: raise _flood(10)
+            yield cm.ArchivedMessage(msg_id, None, "")
+
+
+def test_iter_messages_resumes_after_flood_wait(clock):
+    # 速率取 2 的幂，假时钟上的等待时间没有浮点误差
+    limiter = cm.RateLimiter(128)
+    client = FloodingHistory(total=250, flood_after=120)
+
+    async def scenario():
+        return [msg.id async for msg in limiter.iter_messages('iter_messages', client, 'chan', limit=200)]
+
+    # 从最后一条已返回的消息处续传，不重复也不遗漏，总数仍受 limit 限制
+    assert asyncio.run(scenario()) == list(range(250, 50, -1))
+    assert client.requests == [(200, 0), (80, 131)]
+    assert limiter.counters['iter_messages']['retries'] == 1
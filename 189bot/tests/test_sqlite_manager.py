@@ -0,0 +1,109 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import cloud_monitor as cm
+
+
+class InterruptingCursor:
+    """第一次写 processed_msgs 时模拟 SIGTERM 处理器抛出的 SystemExit"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.interrupted = False
+
+    def executemany(self, sql, rows):
+        if not self.interrupted and 'processed_msgs' in sql:
+            self.interrupted = True
+            raise SystemExit(0)
+        return self._cursor.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def test_flush_interrupted_by_system_exit_keeps_pending_writes(tmp_path):
+    db = cm.SQLiteManager(str(tmp_path), batch_size=1000, flush_interval=3600)
+    db.add_link('https://cloud.189.cn/t/aaaaaaaaaaaa', 0)
+    db.bulk_add_msgs([('chan', 1, 0, 1.0)])
+    real_cursor = db.cursor
+    db.cursor = InterruptingCursor(real_cursor)
+
+    with pytest.raises(SystemExit):
+        db.flush()
+    # 事务回滚，缓冲区中的已确认推送仍在，close() 时提交
+    assert db._pending_links and db._pending_msgs
+    db.cursor = real_cursor
+    db.close()
+
+    conn = sqlite3.connect(db.db_file)
+    assert conn.execute("SELECT COUNT(*) FROM sent_links").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM processed_msgs").fetchone()[0] == 1
+
+
+class BrokenMigrationManager(cm.SQLiteManager):
+    MIGRATIONS = cm.SQLiteManager.MIGRATIONS + ["_migrate_broken"]
+
+    def _migrate_broken(self):
+        self.cursor.execute("CREATE TABLE half_done (x INTEGER)")
+        raise sqlite3.OperationalError("boom")
+
+
+def test_migrations_upgrade_to_latest_version(tmp_path):
+    db = cm.SQLiteManager(str(tmp_path))
+    assert db.cursor.execute("PRAGMA user_version").fetchone()[0] == len(cm.SQLiteManager.MIGRATIONS)
+    db.close()
+
+
+def test_failed_migration_rolls_back_ddl_and_version(tmp_path):
+    db = BrokenMigrationManager(str(tmp_path))
+    latest = len(cm.SQLiteManager.MIGRATIONS)
+    # 之前的迁移已提交，失败的一步 (含 DDL) 整体回滚
+    assert db.cursor.execute("PRAGMA user_version").fetchone()[0] == latest
+    assert db.cursor.execute("SELECT name FROM sqlite_master WHERE name='half_done'").fetchone() is None
+    # 迁移结束后恢复隐式事务，写缓冲仍按批提交
+    assert db.conn.isolation_level == ""
+    db.close()
+
+
+def test_async_reads_see_writes_submitted_during_flush(tmp_path):
+    async def scenario():
+        db = cm.AsyncSQLiteManager(str(tmp_path))
+        try:
+            db.update_channel_state('chan', 1)
+            # 第一次读取触发 flush；flush 尚未完成时提交新的写入
+            first = asyncio.create_task(db.get_channel_state('chan'))
+            await asyncio.sleep(0)
+            db.update_channel_state('chan', 2)
+            assert (await first)[0] >= 1
+            # 之后的读取必须能读到 flush 入队之后提交的写入
+            return (await db.get_channel_state('chan'))[0]
+        finally:
+            db.close()
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_async_reads_retry_flush_after_failed_commit(tmp_path):
+    async def scenario():
+        db = cm.AsyncSQLiteManager(str(tmp_path))
+        admin = sqlite3.connect(db.db.db_file)
+        try:
+            admin.execute("CREATE TRIGGER reject BEFORE INSERT ON processed_msgs BEGIN SELECT RAISE(ABORT, 'disk full'); END")
+            admin.commit()
+            db.bulk_add_msgs([('chan', 1, 0, 1.0)])
+            # 提交失败，写入放回写线程的缓冲区
+            assert 1 not in await db.load_processed_ids('chan', 0)
+            admin.execute("DROP TRIGGER reject")
+            admin.commit()
+            # 下一次读取前重新 flush，读到之前失败的写入
+            first = 1 in await db.load_processed_ids('chan', 0)
+            # 单条查询同样先提交缓冲区
+            db.bulk_add_msgs([('chan', 2, 0, 1.0)])
+            return first, await db.is_msg_processed('chan', 2)
+        finally:
+            admin.close()
+            db.close()
+
+    assert asyncio.run(scenario()) == (True, True)
@@ -0,0 +1,78 @@
+import json
+import os
+import re
+
+import cloud_monitor as cm
+
+# 合成语料，不是频道里抓取的真实帖子: 约 400 条是 docker/alist-tvbox/shares.txt 的原始分享行，
+# 约 700 条是用分享行中的标题按常见频道帖子格式 (名称/描述/链接行、广告尾、标签、@、裸域名、emoji) 拼出的多行文本，
+# 其余是手写的边界用例
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'synthetic_posts.jsonl')
+
+
+# --- StringCleaner 重写前的实现 (逐条 re.sub)，作为逐字节比较的参照 ---
+
+LEGACY_JUNK_KEYWORDS = [
+    "福利", "频道", "关注", "置顶", "推荐", "via", "转自", "来源", "投稿", "小编", "整理", "失效", "补档",
+    "禁言", "通知", "更新", "日更", "公众号", "加入", "点击", "领取"
+]
+LEGACY_AD_PATTERNS = [
+    r'天翼云盘.*资源分享', r'via\s*🤖編號\s*9527', r'🏷?\s*标签\s*：.*', r'[🏷#]\s*\w+',
+    r'UC网盘.*分享', r'资源编号：\d+', r'123网盘.*分享', r'https?://\S+',
+    r'[a-zA-Z0-9]+\.(cn|com|net)/\S+'
+]
+
+
+def legacy_clean(text):
+    if not text: return ""
+    for p in LEGACY_AD_PATTERNS:
+        text = re.sub(p, '', text, flags=re.IGNORECASE)
+    text = re.sub(r'https?://\S+', '', text)
+    text = re.sub(r'[@#]\S+', '', text)
+    text = re.sub(r'[\U00010000-\U0010ffff]', '', text)
+    text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9,，.。!！?？:：《》()（）【】\+\-\s\u3000&/_]', ' ', text)
+    return text.strip()[:195]
+
+
+def legacy_is_junk_line(line):
+    line = line.strip()
+    if len(line) < 2: return True
+    for kw in LEGACY_JUNK_KEYWORDS:
+        if kw in line: return True
+    if re.match(r'^[\d\s\.\-\*]+$', line): return True
+    return False
+
+
+def corpus_inputs():
+    """每条合成帖子本身、逐行 (原样与 strip 后)、以及"名称："之后的标题部分，与 extract_links 的调用方式一致"""
+    with open(CORPUS, encoding='utf-8') as f:
+        posts = [json.loads(line) for line in f]
+    inputs = []
+    for post in posts:
+        inputs.append(post)
+        for line in post.split('\n'):
+            inputs += [line, line.strip()]
+        m = re.search(r'(?:资源|文件)?(?:名称|名|片名|Title)[：:]\s*(.+)', post)
+        if m: inputs.append(m.group(1))
+    return inputs
+
+
+def test_corpus_is_present():
+    assert len(corpus_inputs()) > 5000
+
+
+def test_clean_is_byte_identical_to_legacy():
+    cm.StringCleaner.clean.cache_clear()
+    for text in corpus_inputs():
+        assert cm.StringCleaner.clean(text).encode('utf-8') == legacy_clean(text).encode('utf-8'), text
+
+
+def test_clean_cache_returns_same_result_on_repeat():
+    inputs = corpus_inputs()[:500]
+    first = [cm.StringCleaner.clean(t) for t in inputs]
+    assert [cm.StringCleaner.clean(t) for t in inputs] == first
+
+
+def test_is_junk_line_matches_legacy():
+    for text in corpus_inputs():
+        assert cm.StringCleaner.is_junk_line(text) == legacy_is_junk_line(text), text
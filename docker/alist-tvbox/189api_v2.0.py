@@ -42,6 +42,7 @@ SAVE_PATH = "/mnt/alist-tvbox"     # 改你自己的数据库保存路径
 LOOP_SWITCH = 2                    # 1 = 循环监控(常驻), 2 = 单次运行(跑完退出)
 MONITOR_INTERVAL_HOURS = 3         # 循环模式下的间隔时间 (单位: 小时)
 MAX_CONCURRENT_REQUESTS = 10       # 推送并发线程数
+CHANNEL_CONCURRENCY = 3            # 同时扫描的频道数 (1 = 逐个频道顺序扫描)
 
 # [全局扫描参数]
 MONITOR_LIMIT = 3000               # 每个频道最大扫描消息数
@@ -105,6 +106,10 @@ class Dashboard:
     # 列宽配置: Channel/Project(16) | Progress(13) | Found(13) | Added(13) | Time(13)
     HEADER_FMT = "{:<16} | {:>13} | {:>13} | {:>13} | {:>13}"
     ROW_FMT    = "{:<16} | {:>13} | {:>13} | {:>13} | {:>13}"
+
+    # 并发扫描时，所有进行中的频道共用底部的"实时区域"，完成的频道固定输出在其上方
+    _live_frames = {}
+    _live_height = 0
     
     @staticmethod
     def print_header():
@@ -113,8 +118,8 @@ class Dashboard:
         print("-" * 80)
 
     @staticmethod
-    def print_channel_frame(channel_name, total, current, stats, start_time, is_final=False):
-        """绘制信息"""
+    def print_channel_frame(channel_name, total, current, stats, start_time, is_final=False, key=None):
+        """绘制信息。key 标识实时区域中的帧 (频道 id)，显示名相同的频道 (如 +invite 链接) 不会互相覆盖"""
         # 计算耗时
         duration_str = "-"
         if start_time:
@@ -158,13 +163,37 @@ class Dashboard:
         line4 = Dashboard.ROW_FMT.format("  |_ Special", "-", str(sp_found), str(sp_added), "-")
 
         # 打印并处理光标回退
-        print(f"\r{line1}\033[K\n{line2}\033[K\n{line3}\033[K\n{line4}\033[K", end="")
-        
-        if not is_final:
-            sys.stdout.write("\033[F\033[F\033[F") 
-            sys.stdout.flush()
+        rule_lines = [line1, line2, line3, line4]
+        Dashboard._clear_live()
+        if is_final:
+            Dashboard._live_frames.pop(key or channel_name, None)
+            print("\n".join(rule_lines))
+            print("-" * 80)
         else:
-            print() # 完成时换行
+            Dashboard._live_frames[key or channel_name] = rule_lines
+        Dashboard._draw_live()
+
+    @staticmethod
+    def _clear_live():
+        if Dashboard._live_height:
+            sys.stdout.write("\033[F" * Dashboard._live_height + "\033[J")
+            Dashboard._live_height = 0
+
+    @staticmethod
+    def _draw_live():
+        height = 0
+        for lines in Dashboard._live_frames.values():
+            for line in lines:
+                sys.stdout.write(line + "\033[K\n")
+            height += len(lines)
+        Dashboard._live_height = height
+        sys.stdout.flush()
+
+    @staticmethod
+    def print_message(text):
+        Dashboard._clear_live()
+        print(text)
+        Dashboard._draw_live()
 
 # ==============================================================================
 # ====== 💻 核心逻辑代码 (Core Logic) ===========================================
@@ -344,14 +373,19 @@ class CloudMonitor:
 
     async def run_cycle(self, session):
         Dashboard.print_header()
-        for channel_url in CHANNEL_URLS:
-            try:
-                await self.process_channel_unified(session, channel_url)
-                print("-" * 80)
-            except Exception as e:
-                print(f"\n❌ {channel_url} Error: {e}")
-                self.logger.error(f"Run Cycle Error for {channel_url}: {traceback.format_exc()}")
-                print("-" * 80)
+        channel_sem = asyncio.Semaphore(CHANNEL_CONCURRENCY)
+
+        async def run_one(channel_url):
+            async with channel_sem:
+                try:
+                    return await self.process_channel_unified(session, channel_url)
+                except Exception as e:
+                    Dashboard.print_message(f"❌ {channel_url} Error: {e}")
+                    self.logger.error(f"Run Cycle Error for {channel_url}: {traceback.format_exc()}")
+                    return None
+
+        results = await asyncio.gather(*(run_one(url) for url in CHANNEL_URLS))
+        return dict(zip(CHANNEL_URLS, results))
 
     async def process_channel_unified(self, session, channel_url):
         channel_name = channel_url.split('/')[-1]
@@ -364,16 +398,16 @@ class CloudMonitor:
         }
         
         start_time = datetime.now()
-        Dashboard.print_channel_frame(channel_name, 0, 0, stats, start_time)
+        Dashboard.print_channel_frame(channel_name, 0, 0, stats, start_time, key=channel_id)
 
         try:
             any_try_join = any(cfg.get('try_join', False) for cfg in API_CONFIGS)
             entity = await self.get_entity_safe(channel_url, any_try_join)
             
             if not entity:
-                Dashboard.print_channel_frame(channel_name, -1, -1, stats, start_time, is_final=True)
+                Dashboard.print_channel_frame(channel_name, -1, -1, stats, start_time, is_final=True, key=channel_id)
                 self.logger.error(f"Channel not found or cannot join: {channel_url}")
-                return
+                return stats
 
             # --- Phase 1: Standard Scan ---
             min_date = datetime.now(timezone.utc) - timedelta(days=MONITOR_DAYS)
@@ -394,7 +428,7 @@ class CloudMonitor:
                     messages.append(msg)
                     fetch_count += 1
                     if fetch_count % 50 == 0:
-                        Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time)
+                        Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time, key=channel_id)
                         
             except ChannelPrivateError: 
                 self.logger.error(f"Access Denied (Private) for channel: {channel_url}")
@@ -403,7 +437,7 @@ class CloudMonitor:
                 await self._process_message_batch(session, messages, channel_name, channel_id, stats, start_time)
 
             # --- Phase 2: Priority Search ---
-            Dashboard.print_channel_frame(channel_name, 0, 0, stats, start_time)
+            Dashboard.print_channel_frame(channel_name, 0, 0, stats, start_time, key=channel_id)
 
             for api_idx, cfg in enumerate(API_CONFIGS):
                 priorities = cfg.get('priority_keywords', [])
@@ -423,11 +457,12 @@ class CloudMonitor:
                             restrict_to_api_idx=api_idx
                         )
 
-            Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time, is_final=True)
+            Dashboard.print_channel_frame(channel_name, MONITOR_LIMIT, fetch_count, stats, start_time, is_final=True, key=channel_id)
 
         except Exception as e:
             self.logger.error(f"Process Channel Error {channel_name}: {traceback.format_exc()}")
-            Dashboard.print_channel_frame(channel_name, -1, -1, stats, start_time, is_final=True)
+            Dashboard.print_channel_frame(channel_name, -1, -1, stats, start_time, is_final=True, key=channel_id)
+        return stats
 
     async def _process_message_batch(self, session, messages, channel_name, channel_id, stats, start_time, restrict_to_api_idx=None):
         tasks = []
@@ -440,7 +475,7 @@ class CloudMonitor:
         for msg in messages:
             current_idx += 1
             if current_idx % 20 == 0:
-                Dashboard.print_channel_frame(channel_name, total_len, current_idx, stats, start_time)
+                Dashboard.print_channel_frame(channel_name, total_len, current_idx, stats, start_time, key=channel_id)
 
             if not msg.text: continue
 
@@ -491,22 +526,22 @@ class CloudMonitor:
                     }
                     
                     self.session_sent_links.add((info['link'], api_idx))
-                    tasks.append(self.push_wrapper(session, payload, info, msg.id, api_idx, is_special_hit, channel_name, total_len, current_idx, stats, start_time))
+                    tasks.append(self.push_wrapper(session, payload, info, msg.id, api_idx, is_special_hit, channel_name, channel_id, total_len, current_idx, stats, start_time))
         
         if tasks:
-            Dashboard.print_channel_frame(channel_name, total_len, total_len, stats, start_time)
+            Dashboard.print_channel_frame(channel_name, total_len, total_len, stats, start_time, key=channel_id)
             await asyncio.gather(*tasks)
         
         self.db.bulk_add_msgs(msgs_to_save)
 
-    async def push_wrapper(self, session, payload, info, msg_id, api_idx, is_special_hit, channel_name, total, current, stats, start_time):
+    async def push_wrapper(self, session, payload, info, msg_id, api_idx, is_special_hit, channel_name, channel_id, total, current, stats, start_time):
         success, resp = await self.send_to_api(session, payload)
         if success:
             stats[api_idx]['added'] += 1
             if is_special_hit:
                 stats['special']['added'] += 1
             self.db.add_link(info['link'], api_idx)
-            Dashboard.print_channel_frame(channel_name, total, current, stats, start_time)
+            Dashboard.print_channel_frame(channel_name, total, current, stats, start_time, key=channel_id)
         elif resp != "Exists":
             self.logger.error(f"Push Failed [{resp}] for {info['desc']}: {info['link']}")
 